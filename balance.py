@@ -0,0 +1,361 @@
+"""Симулятор баланса КиберБарсика: тысячи сидированных забегов ботами без отрисовки.
+
+Запуск: python balance.py [--sessions N] [--minutes M] [--workers W] [--policy NAME]
+                          [--sweep ПАРАМЕТР=ЗНАЧЕНИЕ,ЗНАЧЕНИЕ ...] [--csv FILE] [--json FILE]
+
+Забег идёт по настоящим правилам GameScene (физика, дроны, взлом, рыба, магазин),
+только SceneManager не рисует, а вместо клавиатуры ходит бот. Параметры --sweep:
+spawn - шанс дрона за шаг, fish - доля дронов с рыбой, damage - урон дрона,
+growth - рост цены улучшения, cost_speed/cost_jump/cost_double_jump - стартовые цены.
+Каждое сочетание значений прогоняется на одних и тех же сидах.
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+# Иначе SDL перехватывает SIGTERM и пул не может остановить процессы
+os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")
+
+import pygame
+import test as game
+
+# Параметр --sweep -> константа баланса в test.py
+CONSTANTS = {
+    "spawn": "DRONE_SPAWN_CHANCE",
+    "fish": "DRONE_FISH_CHANCE",
+    "damage": "DRONE_DAMAGE",
+    "growth": "SHOP_COST_GROWTH",
+}
+# Параметр --sweep -> стартовая цена товара магазина
+COSTS = {"cost_speed": "speed", "cost_jump": "jump", "cost_double_jump": "double_jump"}
+UPGRADES = [("speed", 1), ("speed", 2), ("speed", 3), ("jump", 1), ("jump", 2), ("jump", 3), ("double_jump", 1)]
+
+class IdleBot:
+    """Стоит на месте и ничего не делает - нижняя граница выживания"""
+    def __init__(self, rand):
+        self.rand = rand
+    
+    def act(self, session):
+        return [], ()
+
+_mask_bounds = {}  # маска -> рамка её пикселей
+
+def body_rect(mask, pos):
+    """Рамка непрозрачных пикселей маски в мировых координатах"""
+    rect = _mask_bounds.get(mask)
+    if rect is None:
+        rect = _mask_bounds[mask] = mask.get_bounding_rects()[0]
+    return rect.move(pos)
+
+def fish_spot(drone):
+    """Точка, где появится рыба взломанного дрона, - его центр"""
+    return pygame.Rect(drone.rect.center, (1, 1))
+
+class HunterBot:
+    """Собирает рыбу касанием пикселей, взламывает дронов с рыбой и закупается.
+    
+    Рыба подбирается только касанием масок, поэтому бот ведёт к цели тело
+    игрока, а не его рамку, и прыгает, когда рыба выше тела. Цели, до которых
+    не дотянуться (за стеной, выше прыжка, не успеть до исчезновения), и дроны,
+    чью рыбу потом не достать, пропускаются. Дрона, который вот-вот заденет,
+    бот взламывает, а не перепрыгивает: прыжок чаще уводит в соседнего дрона.
+    
+    skill - шанс ввести код без ошибки, key_frames - кадров на одну клавишу,
+    threat_margin - за сколько пикселей до касания тел взламывать дрона без рыбы,
+    priority - порядок покупок в магазине.
+    """
+    def __init__(self, rand, skill=0.9, key_frames=6, threat_margin=40,
+                 priority=("double_jump", "jump", "speed")):
+        self.rand = rand
+        self.skill = skill
+        self.threat_margin = threat_margin
+        self.key_frames = key_frames
+        self.priority = priority
+        self.typing = ""
+        self.wait = 0
+        self.ground_top = None  # верх тела игрока, стоящего на земле
+    
+    def act(self, session):
+        scene = session.scene
+        if scene.hacking_game is not None:
+            return self.type_code(scene.hacking_game), ()
+        self.typing = ""
+        
+        for kind in self.priority:
+            item = next(item for item in scene.shop.items if item["type"] == kind)
+            session.buy(item)
+        
+        player = scene.player
+        body = body_rect(*player.collision_mask())
+        if player.on_ground:
+            self.ground_top = body.top
+        
+        target = player.target_drone
+        if target is not None:
+            # Дрона с рыбой взламываем и выше прыжка: рыбу может достать прыжок с платформы
+            wanted = target.has_fish and self.within_reach(scene, player, body, fish_spot(target), vertical=False)
+            if wanted or self.threatens(target, body):
+                return [(pygame.K_h, "h")], ()
+        
+        lo, hi = self.walls(scene, player, body)
+        fish = self.reachable_fish(scene, player, body)
+        if fish is not None:
+            dx = min(max(fish.rect.centerx, lo), hi) - body.centerx
+            return self.approach(player, body, fish.rect, dx)
+        drone = self.reachable_drone(scene, player, body)
+        if drone is not None:
+            # Для взлома рамки игрока и дрона должны пересечься
+            dx = min(max(drone.rect.centerx, lo), hi) - body.centerx
+            return self.approach(player, player.rect, drone.rect, dx)
+        return [], ()
+    
+    def threatens(self, drone, body):
+        return body.inflate(self.threat_margin, self.threat_margin).colliderect(
+            body_rect(drone.mask, drone.rect.topleft))
+    
+    def reach(self, player):
+        """Насколько выше тела на земле дотягивается игрок прыжками"""
+        height = player.jump_power ** 2 / (2 * 0.8)
+        return height * (1 + player.upgrades["double_jump"]) * 0.9
+    
+    def walls(self, scene, player, body):
+        """Крайние положения центра тела по горизонтали"""
+        left = int(scene.camera.x)
+        right = left + game.WIDTH if scene.streamer is None else float("inf")
+        offset = body.x - player.rect.x
+        return left + offset + body.width // 2, right - player.rect.width + offset + body.width // 2
+    
+    def within_reach(self, scene, player, body, rect, vertical=True):
+        """Можно ли коснуться телом rect: не за стеной и (vertical) не выше прыжка с земли"""
+        lo, hi = self.walls(scene, player, body)
+        # Края рамки тела - ещё не пиксели: цель должна лечь на его середину
+        if abs(rect.centerx - min(max(rect.centerx, lo), hi)) > body.width // 4:
+            return False
+        return not vertical or self.ground_top is None or rect.bottom >= self.ground_top - self.reach(player)
+    
+    def reachable_fish(self, scene, player, body):
+        lo, hi = self.walls(scene, player, body)
+        best, best_time = None, None
+        for fish in scene.fishes:
+            if not self.within_reach(scene, player, body, fish.rect):
+                continue
+            goal = min(max(fish.rect.centerx, lo), hi)
+            steps = abs(goal - body.centerx) / player.speed
+            if steps >= fish.lifetime:
+                continue
+            if best is None or steps < best_time:
+                best, best_time = fish, steps
+        return best
+    
+    def reachable_drone(self, scene, player, body):
+        best = None
+        for drone in scene.drones:
+            if not drone.has_fish or not self.within_reach(scene, player, body, fish_spot(drone)):
+                continue
+            if best is None or abs(drone.rect.centerx - body.centerx) < abs(best.rect.centerx - body.centerx):
+                best = drone
+        return best
+    
+    def approach(self, player, own, goal, dx):
+        """Сдвиг на dx по горизонтали и прыжок, пока own (тело или рамка игрока) ниже goal"""
+        presses = []
+        held = set()
+        if dx > 4:
+            held.add(pygame.K_d)
+        elif dx < -4:
+            held.add(pygame.K_a)
+        # Цель выше - прыжок с земли, почти под ней; второй прыжок на спаде
+        if (goal.bottom <= own.top and abs(dx) < own.width // 2
+                and (player.on_ground or player.velocity_y > 0)):
+            presses.append((pygame.K_w, "w"))
+        return presses, held
+    
+    def type_code(self, hacking_game):
+        if self.wait > 0:
+            self.wait -= 1
+            return []
+        if not self.typing:
+            code = hacking_game.code
+            if self.rand.random() >= self.skill:
+                code = str(self.rand.randint(1000, 9999))
+            self.typing = code + "\r"
+        self.wait = self.key_frames
+        char, self.typing = self.typing[0], self.typing[1:]
+        if char == "\r":
+            return [(pygame.K_RETURN, "\r")]
+        return [(getattr(pygame, f"K_{char}"), char)]
+
+POLICIES = {"idle": IdleBot, "hunter": HunterBot}
+
+class Session:
+    """Один забег бота: источник ввода для SceneManager и сбор статистики"""
+    def __init__(self, params, seed, policy):
+        self.manager = game.SceneManager(clock=game.FixedClock(), render=False)
+        self.manager.controls = self
+        self.scene = game.GameScene(persistent=False)
+        for name, kind in COSTS.items():
+            if name in params:
+                item = next(item for item in self.scene.shop.items if item["type"] == kind)
+                item["cost"] = int(params[name])
+        self.scene.shop.refresh_labels()
+        self.policy = POLICIES[policy](random.Random(seed))
+        self.frame = -1
+        self.held = ()
+        self.spent = 0
+        self.upgrades = {}  # (тип, уровень) -> секунда покупки
+    
+    def seconds(self):
+        return (self.frame + 1) / game.SIM_HZ
+    
+    def buy(self, item):
+        cost = item["cost"]
+        if not self.scene.shop.buy(item):
+            return False
+        self.spent += cost
+        self.upgrades[(item["type"], item["level"])] = round(self.seconds(), 2)
+        return True
+    
+    def events(self):
+        self.frame += 1
+        presses, self.held = self.policy.act(self)
+        return [game.key_event(key, unicode) for key, unicode in presses]
+    
+    def wait(self, timeout_ms):
+        return self.events()
+    
+    def pressed(self):
+        return game.HeldKeys(self.held)
+    
+    def mouse_pos(self):
+        return (0, 0)
+    
+    def run(self, max_frames):
+        self.manager.push(self.scene)
+        return self.manager.run(max_frames)
+
+def init_worker():
+    pygame.display.set_mode((game.WIDTH, game.HEIGHT))
+    game.assets.preload(game.GAME_SPRITES)
+    # Регулятор качества меряет реальное время кадра - симуляции он не нужен
+    game.quality.enabled = False
+    game.quality.reset()
+
+def run_session(task):
+    config, params, seed, minutes, policy = task
+    for name, constant in CONSTANTS.items():
+        if name in params:
+            setattr(game, constant, type(getattr(game, constant))(params[name]))
+    game.rng.seed(seed)
+    session = Session(params, seed, policy)
+    result = session.run(int(minutes * 60 * game.SIM_HZ))
+    seconds = session.seconds()
+    player = session.scene.player
+    fish_total = player.fish_count + session.spent
+    row = {
+        "config": config,
+        "seed": seed,
+        **params,
+        "died": result == "menu",
+        "survived_s": round(seconds, 2),
+        "fish_total": fish_total,
+        "fish_per_min": round(fish_total * 60 / seconds, 3),
+    }
+    for kind, level in UPGRADES:
+        row[f"{kind}{level}_s"] = session.upgrades.get((kind, level))
+    return row
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+def summarize(config, params, rows):
+    survived = [row["survived_s"] for row in rows]
+    fish_per_min = [row["fish_per_min"] for row in rows]
+    summary = {
+        "config": config,
+        **params,
+        "sessions": len(rows),
+        "died_share": round(sum(row["died"] for row in rows) / len(rows), 3),
+        "survived_s": {"mean": round(statistics.mean(survived), 1), "p10": percentile(survived, 0.1),
+                       "p50": percentile(survived, 0.5), "p90": percentile(survived, 0.9)},
+        "fish_per_min": {"mean": round(statistics.mean(fish_per_min), 2), "p50": percentile(fish_per_min, 0.5)},
+        "upgrades": {},
+    }
+    for kind, level in UPGRADES:
+        times = [row[f"{kind}{level}_s"] for row in rows if row[f"{kind}{level}_s"] is not None]
+        summary["upgrades"][f"{kind}{level}"] = {
+            "reached": round(len(times) / len(rows), 3),
+            "p50_s": percentile(times, 0.5),
+        }
+    return summary
+
+def parse_sweep(items):
+    grid = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        if name not in CONSTANTS and name not in COSTS:
+            raise SystemExit(f"Неизвестный параметр {name}: {', '.join(list(CONSTANTS) + list(COSTS))}")
+        grid[name] = [float(value) for value in values.split(",")]
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200, help="забегов на сочетание параметров")
+    parser.add_argument("--minutes", type=float, default=10, help="предел длины забега в игровых минутах")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=2045)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="hunter")
+    parser.add_argument("--sweep", nargs="*", default=[], metavar="ПАРАМЕТР=ЗНАЧЕНИЯ")
+    parser.add_argument("--csv", help="построчные результаты забегов")
+    parser.add_argument("--json", help="сводка по сочетаниям параметров")
+    args = parser.parse_args()
+    
+    configs = parse_sweep(args.sweep)
+    tasks = [(config, params, args.seed + i, args.minutes, args.policy)
+             for config, params in enumerate(configs) for i in range(args.sessions)]
+    
+    start = time.perf_counter()
+    rows = []
+    # spawn, а не fork: у каждого процесса свой pygame и своё окно
+    with multiprocessing.get_context("spawn").Pool(args.workers, initializer=init_worker) as pool:
+        for row in pool.imap_unordered(run_session, tasks, chunksize=4):
+            rows.append(row)
+            if len(rows) % 100 == 0:
+                print(f"{len(rows)}/{len(tasks)} забегов, {time.perf_counter() - start:.0f} с", file=sys.stderr)
+        pool.close()
+        pool.join()
+    rows.sort(key=lambda row: (row["config"], row["seed"]))
+    
+    summaries = [summarize(config, params, [row for row in rows if row["config"] == config])
+                 for config, params in enumerate(configs)]
+    for summary in summaries:
+        params = " ".join(f"{name}={summary[name]}" for name in configs[summary["config"]])
+        survived = summary["survived_s"]
+        upgrades = " ".join(f"{name}={value['p50_s']}" for name, value in summary["upgrades"].items()
+                            if value["reached"] >= 0.5)
+        print(f"[{summary['config']}] {params or 'текущий баланс'}: погибло {summary['died_share']:.0%}, "
+              f"жизнь p10/p50/p90 {survived['p10']}/{survived['p50']}/{survived['p90']} с, "
+              f"рыб/мин {summary['fish_per_min']['mean']}, улучшения (медиана, с): {upgrades or '-'}")
+    print(f"{len(rows)} забегов за {time.perf_counter() - start:.1f} с на {args.workers} процессах", file=sys.stderr)
+    
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
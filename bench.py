@@ -0,0 +1,129 @@
+"""Headless-бенчмарк КиберБарсика: прогон сценариев без окна и звука.
+
+Запуск: python bench.py [--frames N] [--seed S] [--scenario NAME ...] [--adaptive] [--json]
+
+Без --adaptive качество закреплено на верхнем уровне, чтобы прогоны были сравнимы.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import pygame
+import test as game
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def idle_script(frames):
+    return {}, ()
+
+def swarm_script(frames):
+    return {}, ()
+
+def shop_script(frames):
+    # ESC -> пауза, клик по "Магазин", дальше мышь гуляет по кнопкам
+    shop_button = (game.WIDTH // 2, game.HEIGHT // 2 + 45)
+    events = {1: [game.key_event(pygame.K_ESCAPE)], 2: [game.click_event(shop_button)]}
+    for frame in range(3, frames):
+        y = 200 + (frame * 7) % 300
+        events[frame] = [game.motion_event((game.WIDTH // 2, y))]
+    return events, ()
+
+def endless_script(frames):
+    # Бежим вправо весь прогон, периодически прыгая
+    events = {frame: [game.key_event(pygame.K_w, "w")] for frame in range(0, frames, 45)}
+    return events, [(0, frames, pygame.K_d)]
+
+def hacking_script(frames):
+    # Идём навстречу дронам и жмём H, пока не начнётся взлом, затем вводим код
+    keys = [(pygame.K_h, "h"), (pygame.K_1, "1"), (pygame.K_2, "2"),
+            (pygame.K_3, "3"), (pygame.K_4, "4"), (pygame.K_RETURN, "\r")]
+    events = {}
+    for frame in range(frames):
+        key, unicode = keys[frame % len(keys)]
+        events[frame] = [game.key_event(key, unicode)]
+    return events, [(0, frames, pygame.K_d)]
+
+SCENARIOS = {
+    "idle": (idle_script, {}),
+    "max_drones": (swarm_script, {"swarm": True}),
+    "shop_open": (shop_script, {}),
+    "hacking": (hacking_script, {}),
+    "endless": (endless_script, {"endless": True}),
+}
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+def play(name, frames, seed, adaptive, timings=None):
+    """Один прогон сценария с одинаковыми сидом и вводом"""
+    script, options = SCENARIOS[name]
+    events, held = script(frames)
+    game.rng.seed(seed)
+    game.quality.enabled = adaptive
+    game.quality.reset()
+    return game.main_game(controls=game.ScriptedInput(events, held), clock=game.FixedClock(),
+                          max_frames=frames, persistent=False, timings=timings, **options)
+
+def run_scenario(name, frames, seed, adaptive=False):
+    # Хуки tracemalloc замедляют каждое выделение памяти, поэтому время
+    # меряется в чистом прогоне, а пик памяти Python - в отдельном повторном
+    timings = game.FrameTimings()
+    start = time.perf_counter()
+    result = play(name, frames, seed, adaptive, timings)
+    elapsed = time.perf_counter() - start
+    quality_level, quality_changes = game.quality.level, game.quality.changes
+    
+    tracemalloc.start()
+    play(name, frames, seed, adaptive)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {
+        "scenario": name,
+        "result": result,
+        "frames": timings.frames,
+        "seconds": round(elapsed, 3),
+        "fps": round(timings.frames / elapsed, 1) if elapsed else None,
+        "ms": {phase: round(value, 3) for phase, value in timings.averages(grouped=True).items()},
+        "phases_ms": {phase: round(value, 3) for phase, value in timings.averages().items()},
+        "py_peak_mb": round(peak / (1024 * 1024), 2),
+        "rss_peak_mb": peak_rss_mb(),
+        "quality": quality_level,
+        "quality_changes": quality_changes,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=2045)
+    parser.add_argument("--scenario", nargs="*", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--adaptive", action="store_true", help="включить регулятор качества")
+    parser.add_argument("--json", action="store_true", help="вывод в JSON lines")
+    args = parser.parse_args()
+    
+    for name in args.scenario:
+        report = run_scenario(name, args.frames, args.seed, args.adaptive)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False))
+            continue
+        phases = " ".join(f"{phase}={value:.2f}" for phase, value in report["ms"].items())
+        print(f"{name:<11} {report['frames']:>5} кадров {report['fps']:>8} FPS  "
+              f"py_peak={report['py_peak_mb']} МБ rss_peak={report['rss_peak_mb']} МБ  "
+              f"качество={report['quality']}  мс/кадр: {phases}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Сборка бандла ассетов КиберБарсика (assets/assets.bundle).
+
+Спрайты упаковываются уже подготовленными - в тех размерах и с той
+прозрачностью, с которыми их запрашивает игра, - как сырые пиксели BGRA.
+Звуки кладутся в бандл как есть. Игра загружает бандл через mmap,
+а при его отсутствии или устаревании читает файлы из assets/.
+
+Запуск: python pack_assets.py [--output PATH]
+"""
+import argparse
+import json
+import os
+import struct
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import test as game
+
+ALIGN = 16
+
+def pack_image(spec):
+    key = game.AssetCache.key(*spec)
+    image = game._decode_image(*key)
+    entry = {"size": image.get_size()}
+    colorkey = image.get_colorkey()
+    if colorkey is not None:
+        entry["colorkey"] = list(colorkey)
+    return game.AssetBundle.image_key(key), entry, pygame.image.tobytes(image, "BGRA")
+
+def source_files():
+    for folder in ("images", "sounds"):
+        for name in sorted(os.listdir(game.asset_path(folder))):
+            yield f"{folder}/{name}"
+
+def build(path, specs):
+    index = {"images": {}, "files": {}, "sources": {}}
+    blobs = []
+    offset = 0
+    
+    def add(data):
+        nonlocal offset
+        start = offset
+        blobs.append(data)
+        offset += len(data)
+        padding = -offset % ALIGN
+        blobs.append(b"\0" * padding)
+        offset += padding
+        return start
+    
+    for spec in specs:
+        key, entry, pixels = pack_image(spec)
+        entry["offset"] = add(pixels)
+        index["images"][key] = entry
+    for name in source_files():
+        index["sources"][name] = os.path.getmtime(game.asset_path(name))
+        if name.startswith("sounds/"):
+            with open(game.asset_path(name), "rb") as f:
+                data = f.read()
+            index["files"][name] = {"offset": add(data), "length": len(data)}
+    
+    # Индекс дополняется пробелами, чтобы данные начинались с выровненного адреса
+    header = json.dumps(index).encode()
+    header = header.ljust(len(header) + (-(8 + len(header)) % ALIGN))
+    
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<4sI", game.BUNDLE_MAGIC, len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return len(index["images"]), len(index["files"]), 8 + len(header) + offset
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default=game.BUNDLE_PATH)
+    args = parser.parse_args()
+    
+    pygame.display.set_mode((1, 1))
+    images, files, size = build(args.output, game.GAME_SPRITES)
+    print(f"{args.output}: {images} изображений, {files} файлов, {size / (1024 * 1024):.1f} МБ")
+
+if __name__ == "__main__":
+    main()
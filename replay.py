@@ -0,0 +1,61 @@
+"""Просмотр и проверка повторов КиберБарсика.
+
+Запись: KIBER_REPLAY=файл python test.py - повтор последнего забега пишется в файл.
+Запуск: python replay.py ФАЙЛ [--seek КАДР] [--frames N] [--verify] [--shot FILE] [--play]
+
+Без --play повтор досчитывается без окна так быстро, как получается. --seek
+перематывает к кадру через ближайший ключевой кадр, --verify сверяет состояние
+симуляции с каждым ключевым кадром записи и печатает кадры с расхождениями.
+"""
+import argparse
+import os
+import sys
+import time
+
+if "--play" not in sys.argv:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import test as game
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--seek", type=int, default=0, help="начать с этого кадра")
+    parser.add_argument("--frames", type=int, help="сколько кадров показать после перемотки")
+    parser.add_argument("--verify", action="store_true", help="сверять состояние с ключевыми кадрами")
+    parser.add_argument("--shot", help="сохранить последний кадр в PNG")
+    parser.add_argument("--play", action="store_true", help="показывать в окне в реальном времени")
+    args = parser.parse_args()
+    
+    replay = game.Replay(args.path)
+    print(f"{args.path}: {len(replay.frames)} кадров, {len(replay.keyframes)} ключевых, "
+          f"{sum(frame[0] for frame in replay.frames) / game.SIM_HZ:.1f} с игры", file=sys.stderr)
+    
+    game.quality.enabled = False
+    clock = None if args.play else game.FixedClock()
+    manager = game.SceneManager(clock=clock, render=args.play or args.shot is not None)
+    scene = game.GameScene(swarm=replay.swarm, persistent=False, endless=replay.endless)
+    playback = game.ReplayInput(replay, scene, verify=args.verify)
+    manager.controls = playback
+    manager.push(scene)
+    
+    start = time.perf_counter()
+    playback.seek(args.seek)
+    print(f"перемотка к кадру {args.seek}: {(time.perf_counter() - start) * 1000:.1f} мс "
+          f"(от ключевого кадра {replay.keyframe_before(args.seek)})", file=sys.stderr)
+    
+    start = time.perf_counter()
+    result = manager.run(args.frames) if manager.stack else manager.result
+    print(f"кадр {playback.frame}, итог {result}, {time.perf_counter() - start:.2f} с", file=sys.stderr)
+    if args.shot:
+        pygame.image.save(manager.screen, args.shot)
+    if args.verify:
+        if playback.mismatches:
+            print(f"расхождения с записью на кадрах: {playback.mismatches}")
+            sys.exit(1)
+        print("расхождений с записью нет")
+
+if __name__ == "__main__":
+    main()
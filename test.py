@@ -3,7 +3,23 @@ import sys
 import random
 import os
 import json
-from typing import List
+import time
+import queue
+import atexit
+import threading
+import io
+import mmap
+import struct
+import weakref
+import bisect
+from collections import OrderedDict, deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+START_TIME = time.perf_counter()  # Точка отсчёта для замера холодного старта
 
 # Инициализация
 pygame.init()
@@ -12,6 +28,67 @@ pygame.mixer.init()
 # Настройки
 WIDTH, HEIGHT = 1240, 768
 FPS = 60
+DIRTY_RECTS = False  # Обновлять только изменившиеся области экрана
+COLLISION_CELL = 128  # Размер ячейки сетки столкновений
+SWARM_SIZE = 3000  # Дронов в стресс-режиме роя
+SWARM_SPAWN_PER_FRAME = 50
+SWARM_DRONE_SCALE = 0.1  # Масштаб спрайта дрона в рое (у обычных дронов 0.4)
+CULL_MARGIN = 64  # Запас вокруг экрана, за которым объекты не рисуются
+CHUNK_WIDTH = WIDTH  # Ширина чанка бесконечного мира
+CHUNKS_AHEAD = 2  # Чанков впереди экрана, генерируемых заранее
+CHUNKS_BEHIND = 1  # Чанков позади экрана, ещё не выгруженных
+PLATFORMS_PER_CHUNK = 5
+# Баланс (подбирается прогонами balance.py)
+DRONE_SPAWN_CHANCE = 0.01  # Шанс появления дрона за шаг при BASE_HZ
+DRONE_FISH_CHANCE = 0.3  # Доля дронов с рыбой
+DRONE_DAMAGE = 10
+SHOP_COST_GROWTH = 1.5  # Во сколько раз дорожает улучшение после покупки
+# Симуляция идёт фиксированными шагами независимо от частоты отрисовки.
+# Игровые константы заданы в кадрах при BASE_HZ, шаг масштабирует их на SIM_DT.
+BASE_HZ = 60
+SIM_HZ = 60
+SIM_DT = BASE_HZ / SIM_HZ
+MAX_CATCHUP_STEPS = 5
+DEBUG_OVERLAY_KEY = pygame.K_F3  # Оверлей профилировщика
+REWIND_KEY = pygame.K_F5  # Перемотка на REWIND_STEP_SECONDS назад
+REWIND_EVERY = 6  # Снимок состояния для перемотки раз в столько шагов симуляции
+REWIND_SECONDS = 5  # Глубина буфера перемотки
+REWIND_STEP_SECONDS = 1
+PARTICLE_CAPACITY = 512  # Частиц эффектов одновременно; новые вытесняют самые старые
+PARTICLE_GRAVITY = 0.15  # Ускорение частиц вниз, пикселей за шаг BASE_HZ в квадрате
+PARTICLE_FADE_STEPS = 4  # Стадий затухания в наборе спрайтов частиц
+IDLE_WAIT_MS = 500  # Статичные сцены (меню, пауза) спят до ввода, но не дольше этого
+# Пропускаются в очередь при любых сценах: закрытие окна и его перерисовка после перекрытия
+SYSTEM_EVENTS = (pygame.QUIT, pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED)
+# Регулятор качества: уровни от лучшего к худшему, каждый добавляет одну уступку.
+# drone_cap - доля от обычного лимита дронов, render_scale - масштаб кадра мира,
+# hud_every - HUD перерисовывается раз в столько кадров (в режиме DIRTY_RECTS).
+QUALITY_LEVELS = (
+    {"name": "высокое", "alpha_overlays": True, "drone_cap": 1.0, "render_scale": 1.0, "hud_every": 1},
+    {"name": "без прозрачности", "alpha_overlays": False, "drone_cap": 1.0, "render_scale": 1.0, "hud_every": 1},
+    {"name": "меньше дронов", "alpha_overlays": False, "drone_cap": 0.5, "render_scale": 1.0, "hud_every": 1},
+    {"name": "пол-разрешения", "alpha_overlays": False, "drone_cap": 0.5, "render_scale": 0.5, "hud_every": 1},
+    {"name": "минимальное", "alpha_overlays": False, "drone_cap": 0.5, "render_scale": 0.5, "hud_every": 2},
+)
+QUALITY_WINDOW = 120  # Кадров в скользящем окне замера
+QUALITY_PERCENTILE = 0.9
+QUALITY_DOWN_MS = 0.9 * 1000 / FPS  # Выше - качество понижается
+QUALITY_UP_MS = 0.6 * 1000 / FPS  # Ниже на полном окне - повышается
+QUALITY_FIXED = os.environ.get("KIBER_QUALITY")  # Номер уровня: регулятор выключен, уровень закреплён
+TELEMETRY_PATH = os.environ.get("KIBER_TELEMETRY")  # .csv или .jsonl, None - выключено
+REPLAY_PATH = os.environ.get("KIBER_REPLAY")  # Файл повтора последнего забега, None - выключено
+REPLAY_KEYFRAME_FRAMES = 120  # Ключевой кадр в повторе раз в столько кадров
+# Пути к ассетам и сохранению считаются от файла игры, а не от текущей директории
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.path.join(GAME_DIR, 'assets')
+BUNDLE_PATH = os.path.join(ASSETS_DIR, 'assets.bundle')  # Собирается pack_assets.py
+BUNDLE_MAGIC = b'KBB1'
+SAVE_PATH = os.path.join(GAME_DIR, 'save.json')
+SAVE_VERSION = 2
+AUTOSAVE_SECONDS = 30  # Автосохранение по времени симуляции
+
+# Генератор случайных чисел игры; для воспроизводимых прогонов - rng.seed()
+rng = random.Random()
 
 # Цвета
 BLACK = (0, 0, 0)
@@ -24,30 +101,199 @@ PURPLE = (128, 0, 128)
 DARK_BLUE = (0, 0, 100)
 YELLOW = (255, 255, 0)
 
+# Вспышки частиц: вид -> (цвет, частиц, скорость, время жизни в шагах BASE_HZ)
+PARTICLE_BURSTS = {
+    "hack": (GREEN, 40, 5.0, 40),
+    "fish": (YELLOW, 16, 3.0, 30),
+    "damage": (RED, 24, 4.0, 25),
+}
+
 # Шрифты
 font_small = pygame.font.Font(None, 36)
 font_medium = pygame.font.Font(None, 48)
 font_large = pygame.font.Font(None, 72)
 
-# Звуки (глобальная загрузка)
-HACK_SOUND = None
-JUMP_SOUND = None
-DAMAGE_SOUND = None
-try:
-    HACK_SOUND = pygame.mixer.Sound(os.path.join('assets', 'sounds', 'hack.wav'))
-    JUMP_SOUND = pygame.mixer.Sound(os.path.join('assets', 'sounds', 'jump.wav'))
-    DAMAGE_SOUND = pygame.mixer.Sound(os.path.join('assets', 'sounds', 'damage.wav'))
-except:
-    print("Не удалось загрузить некоторые звуки")
-
-def load_image(name, colorkey=None, scale=1):
-    """Загрузка изображения с обработкой прозрачности и масштабированием"""
-    fullname = os.path.join('assets', 'images', name)
+# Звуки (загружаются в фоне при старте, см. AssetLoader)
+# Категория -> число зарезервированных за ней каналов микшера
+SOUND_CHANNELS = {"player": 2, "world": 2, "ui": 1}
+# Имя -> (файл, категория, кулдаун в мс, громкость)
+SOUNDS = {
+    "jump": ('jump.wav', "player", 120, 0.8),
+    "damage": ('damage.wav', "player", 300, 1.0),
+    "hack": ('hack.wav', "ui", 200, 1.0),
+}
+GAME_SOUNDS = sorted({spec[0] for spec in SOUNDS.values()})
+MUSIC = 'background.mp3'
+MUSIC_VOLUME = 0.5
+
+class SoundManager:
+    """Звуковая подсистема: именованные звуки и пул каналов на категорию.
+    
+    Каждая категория играет только на своих зарезервированных каналах, поэтому
+    частые события (прыжки, урон) не занимают весь микшер. Повтор звука раньше
+    его кулдауна отбрасывается, а при занятых каналах категории вытесняется
+    самый старый голос - работа со звуком за кадр ограничена.
+    """
+    def __init__(self, channels=SOUND_CHANNELS):
+        self.sounds = {}  # имя -> (Sound, категория, кулдаун)
+        self.pools = {}  # категория -> [[канал, время старта]]
+        self.last_played = {}
+        self.plays = 0
+        self.dropped = 0
+        self.stolen = 0
+        total = sum(channels.values())
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), total))
+        pygame.mixer.set_reserved(total)
+        index = 0
+        for category, count in channels.items():
+            self.pools[category] = [[pygame.mixer.Channel(index + i), 0] for i in range(count)]
+            index += count
+    
+    def install(self, loaded):
+        """Регистрирует загруженные буферы (файл -> Sound) под именами из SOUNDS"""
+        missing = False
+        for name, (filename, category, cooldown, volume) in SOUNDS.items():
+            sound = loaded.get(filename)
+            if sound is None:
+                missing = True
+                continue
+            sound.set_volume(volume)
+            self.sounds[name] = (sound, category, cooldown)
+        if missing:
+            print("Не удалось загрузить некоторые звуки")
+    
+    def play(self, name):
+        """Проигрывает звук; False, если его нет или он отброшен кулдауном"""
+        entry = self.sounds.get(name)
+        if entry is None:
+            return False
+        sound, category, cooldown = entry
+        now = pygame.time.get_ticks()
+        if now - self.last_played.get(name, -cooldown) < cooldown:
+            self.dropped += 1
+            return False
+        pool = self.pools[category]
+        voice = next((voice for voice in pool if not voice[0].get_busy()), None)
+        if voice is None:
+            voice = min(pool, key=lambda voice: voice[1])
+            self.stolen += 1
+        voice[0].play(sound)
+        voice[1] = now
+        self.last_played[name] = now
+        self.plays += 1
+        return True
+    
+    def play_music(self, source, namehint=""):
+        """Фоновая музыка; mixer.music декодирует её потоково в аудиопотоке"""
+        pygame.mixer.music.load(source, namehint)
+        pygame.mixer.music.set_volume(MUSIC_VOLUME)
+        pygame.mixer.music.play(-1)
+    
+    def busy_channels(self):
+        return sum(voice[0].get_busy() for pool in self.pools.values() for voice in pool)
+    
+    def stats(self):
+        return {"busy": self.busy_channels(), "channels": sum(map(len, self.pools.values())),
+                "plays": self.plays, "dropped": self.dropped, "stolen": self.stolen}
+
+audio = SoundManager()
+
+def asset_path(*parts):
+    return os.path.join(ASSETS_DIR, *parts)
+
+def open_asset(*parts):
+    """Файл ассета из бандла, а если его там нет - с диска"""
+    if assets.bundle is not None:
+        data = assets.bundle.file('/'.join(parts))
+        if data is not None:
+            return data
+    return open(asset_path(*parts), 'rb')
+
+class AssetBundle:
+    """Упакованные ассеты (см. pack_assets.py), отображённые в память через mmap.
+    
+    Формат: BUNDLE_MAGIC, длина индекса (uint32), JSON-индекс, данные;
+    смещения в индексе отсчитываются от начала данных.
+    Изображения хранятся уже подготовленными (масштаб, прозрачность) как
+    сырые пиксели BGRA - поверхности создаются прямо поверх mmap без
+    декодирования (альфа-спрайты - и без копирования). Прочие файлы
+    (звуки) лежат как есть.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # ACCESS_COPY: поверхности остаются изменяемыми, файл - нет
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, index_size = struct.unpack_from('<4sI', self.data)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"{path}: не бандл ассетов")
+        index = json.loads(self.data[8:8 + index_size])
+        self.images = index["images"]
+        self.files = index["files"]
+        self.sources = index["sources"]
+        self.view = memoryview(self.data)[8 + index_size:]
+    
+    @classmethod
+    def open(cls, path=BUNDLE_PATH):
+        """Бандл или None, если его нет или исходники менялись после сборки"""
+        try:
+            bundle = cls(path)
+        except (OSError, ValueError) as e:
+            if os.path.exists(path):
+                print(f"Не могу открыть бандл ассетов: {e}")
+            return None
+        for name, mtime in bundle.sources.items():
+            try:
+                if os.path.getmtime(asset_path(name)) > mtime:
+                    print("Бандл ассетов устарел, загружаю файлы из assets/")
+                    return None
+            except OSError:
+                pass
+        return bundle
+    
+    @staticmethod
+    def image_key(key):
+        return repr(key)
+    
+    def has_image(self, key):
+        return self.image_key(key) in self.images
+    
+    def image(self, key):
+        entry = self.images.get(self.image_key(key))
+        if entry is None:
+            return None
+        offset, (width, height) = entry["offset"], entry["size"]
+        image = pygame.image.frombuffer(self.view[offset:offset + width * height * 4],
+                                        (width, height), 'BGRA')
+        colorkey = entry.get("colorkey")
+        if colorkey is not None:
+            # Спрайтам с прозрачным цветом нужен формат дисплея без альфы,
+            # иначе blit идёт медленным путём; это копия, но не декодирование
+            image = image.convert()
+            image.set_colorkey(colorkey, pygame.RLEACCEL)
+        else:
+            # Как и после convert_alpha(): без RLE альфа-спрайты рисуются в разы медленнее
+            image.set_colorkey(None, pygame.RLEACCEL)
+        return image
+    
+    def file(self, name):
+        entry = self.files.get(name)
+        if entry is None:
+            return None
+        return io.BytesIO(self.view[entry["offset"]:entry["offset"] + entry["length"]])
+
+def _read_image(name):
+    """Чтение и декодирование файла изображения; можно вызывать из любого потока"""
+    fullname = asset_path('images', name)
     try:
-        image = pygame.image.load(fullname)
+        return pygame.image.load(fullname)
     except pygame.error as e:
         print(f"Не могу загрузить изображение: {fullname}")
         print(f"Ошибка: {e}")
+        return None
+
+def _prepare_image(image, colorkey=None, scale=1, size=None):
+    """Перевод в формат дисплея, прозрачность и масштаб; только главный поток"""
+    if image is None:
         image = pygame.Surface((50, 50))
         image.fill(RED)
     
@@ -59,12 +305,308 @@ def load_image(name, colorkey=None, scale=1):
     else:
         image = image.convert_alpha()
     
-    if scale != 1:
+    if size is not None:
+        image = pygame.transform.scale(image, size)
+    elif scale != 1:
         size = image.get_size()
         image = pygame.transform.scale(image, (int(size[0] * scale), int(size[1] * scale)))
     
     return image
 
+def _decode_image(name, colorkey=None, scale=1, size=None):
+    """Загрузка изображения с диска с обработкой прозрачности и масштабированием"""
+    return _prepare_image(_read_image(name), colorkey, scale, size)
+
+class AssetCache:
+    """Общий кэш изображений: каждый спрайт декодируется один раз за процесс.
+    
+    Возвращаемые поверхности разделяются между всеми вызывающими (flyweight),
+    поэтому изменять их нельзя - для модификаций нужно делать copy().
+    """
+    def __init__(self, bundle=None):
+        self.images = {}
+        self.sprite_sets = {}
+        self.sounds = {}
+        self.bundle = bundle
+        self.loader = None
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(name, colorkey=None, scale=1, size=None):
+        return (name, colorkey, scale, tuple(size) if size is not None else None)
+    
+    def get(self, name, colorkey=None, scale=1, size=None):
+        key = self.key(name, colorkey, scale, size)
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+            image = self._load(key)
+            self.images[key] = image
+        else:
+            self.hits += 1
+        return image
+    
+    def _load(self, key):
+        if self.bundle is not None:
+            image = self.bundle.image(key)
+            if image is not None:
+                return image
+        return _decode_image(*key)
+    
+    def preload(self, specs):
+        """Заранее загружает список (name, colorkey, scale[, size])"""
+        if self.loader is not None:
+            self.loader.finish()
+        for spec in specs:
+            key = self.key(*spec)
+            if key not in self.images:
+                self.misses += 1
+                self.images[key] = self._load(key)
+    
+    def sprite_set(self, name, colorkey=None, scale=1, frames=1, variants=None):
+        """Набор вариантов спрайта (см. SpriteSet), строится один раз на ключ"""
+        variants = variants or {}
+        key = (self.key(name, colorkey, scale), frames, tuple(sorted(variants)))
+        sprites = self.sprite_sets.get(key)
+        if sprites is None:
+            sprites = SpriteSet(self.get(name, colorkey, scale), frames, variants)
+            self.sprite_sets[key] = sprites
+        return sprites
+    
+    def evict(self, name=None):
+        """Удаляет из кэша все варианты изображения name (или весь кэш)"""
+        if name is None:
+            count = len(self.images)
+            self.images.clear()
+            self.sprite_sets.clear()
+            return count
+        keys = [key for key in self.images if key[0] == name]
+        for key in keys:
+            del self.images[key]
+        for key in [key for key in self.sprite_sets if key[0][0] == name]:
+            del self.sprite_sets[key]
+        return len(keys)
+    
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.images),
+                "sprite_sets": len(self.sprite_sets)}
+
+class SpriteSet:
+    """Все варианты спрайта, подготовленные при загрузке.
+    
+    Кадры анимации нарезаются из горизонтальной ленты, для каждого кадра
+    строятся отражённая копия и именованные варианты (например, с индикатором).
+    Отрисовка сводится к get() и одному blit.
+    """
+    def __init__(self, strip, frames=1, variants=None):
+        width = strip.get_width() // frames
+        base = [strip.subsurface((i * width, 0, width, strip.get_height())).copy()
+                for i in range(frames)] if frames > 1 else [strip]
+        self.size = base[0].get_size()
+        self.frames = {}  # (вариант, смотрит вправо) -> [(поверхность, смещение)]
+        self._add(None, [(image, (0, 0)) for image in base])
+        for name, build in (variants or {}).items():
+            self._add(name, [build(image) for image in base])
+    
+    def _add(self, variant, frames):
+        self.frames[(variant, True)] = frames
+        flipped = []
+        for image, (dx, dy) in frames:
+            # Отражаем относительно базового спрайта, а не самого варианта
+            flipped.append((pygame.transform.flip(image, True, False),
+                            (self.size[0] - image.get_width() - dx, dy)))
+        self.frames[(variant, False)] = flipped
+    
+    def get(self, variant=None, facing_right=True, frame=0):
+        """Готовая поверхность и её смещение относительно позиции спрайта"""
+        frames = self.frames[(variant, facing_right)]
+        return frames[frame % len(frames)]
+
+def with_fish_indicator(image):
+    """Вариант дрона с зелёным индикатором рыбы над ним"""
+    width, height = image.get_size()
+    colorkey = image.get_colorkey()
+    if colorkey is not None:
+        variant = pygame.Surface((width, height + 15), 0, image)
+        variant.fill(colorkey)
+        variant.set_colorkey(colorkey)
+    else:
+        variant = pygame.Surface((width, height + 15), pygame.SRCALPHA)
+    variant.blit(image, (0, 15))
+    variant.fill(GREEN, (width // 2 - 5, 0, 10, 10))
+    return variant, (0, -15)
+
+DRONE_VARIANTS = {"fish": with_fish_indicator}
+
+assets = AssetCache(AssetBundle.open())
+
+# Спрайты, которые нужны в каждом забеге
+GAME_SPRITES = [
+    ('player.png', -1, 0.8),
+    ('drone.png', -1, 0.4),
+    ('drone.png', -1, SWARM_DRONE_SCALE),
+    ('fish.png', -1, 0.5),
+    ('fish.png', -1, 0.4),
+    ('background.jpg', None, 1, (WIDTH, HEIGHT)),
+    ('platform.png', None, 1),
+]
+
+def load_image(name, colorkey=None, scale=1, size=None):
+    """Загрузка изображения через общий кэш ассетов"""
+    return assets.get(name, colorkey, scale, size)
+
+class AssetLoader:
+    """Фоновая загрузка ассетов при старте.
+    
+    Рабочий поток читает и декодирует файлы, а перевод в формат дисплея
+    (convert, colorkey, масштаб) и раздача звуков выполняются на главном
+    потоке в pump() небольшими порциями между кадрами меню. Спрайты из
+    бандла декодировать не нужно, их поверхности создаются прямо в pump().
+    """
+    def __init__(self, cache, images, sounds=(), music=None):
+        self.cache = cache
+        self.images = list(images)
+        self.sounds = list(sounds)
+        self.music = music
+        self.total = len(self.images) + len(self.sounds) + (1 if music else 0)
+        self.loaded = 0
+        self.done = False
+        self.finished_at = None
+        self.ready = queue.Queue()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+    
+    @property
+    def progress(self):
+        return self.loaded / self.total if self.total else 1.0
+    
+    def _work(self):
+        decoded = {}
+        bundle = self.cache.bundle
+        for spec in self.images:
+            name = spec[0]
+            if bundle is not None and bundle.has_image(self.cache.key(*spec)):
+                self.ready.put(("bundled", spec, None))
+                continue
+            if name not in decoded:
+                decoded[name] = _read_image(name)
+            self.ready.put(("image", spec, decoded[name]))
+        for name in self.sounds:
+            try:
+                with open_asset('sounds', name) as f:
+                    sound = pygame.mixer.Sound(f)
+            except (pygame.error, OSError):
+                sound = None
+            self.ready.put(("sound", name, sound))
+        if self.music:
+            try:
+                with open_asset('sounds', self.music) as f:
+                    music = io.BytesIO(f.read())
+            except OSError:
+                music = None
+            self.ready.put(("music", self.music, music))
+        self.ready.put(None)
+    
+    def _install(self, item):
+        if item is None:
+            audio.install(self.cache.sounds)
+            self.done = True
+            self.finished_at = time.perf_counter()
+            return
+        kind, spec, data = item
+        if kind in ("image", "bundled"):
+            key = self.cache.key(*spec)
+            if key not in self.cache.images:
+                self.cache.misses += 1
+                if kind == "bundled":
+                    self.cache.images[key] = self.cache._load(key)
+                else:
+                    self.cache.images[key] = _prepare_image(data, *key[1:])
+        elif kind == "sound":
+            self.cache.sounds[spec] = data
+        elif kind == "music" and data is not None:
+            audio.play_music(data, spec)
+        self.loaded += 1
+    
+    def pump(self, budget_ms=4):
+        """Доводит готовые ассеты на главном потоке, тратя не больше budget_ms"""
+        deadline = time.perf_counter() + budget_ms / 1000
+        while not self.done and time.perf_counter() < deadline:
+            try:
+                item = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self._install(item)
+    
+    def finish(self):
+        """Дожидается и устанавливает все оставшиеся ассеты"""
+        while not self.done:
+            self._install(self.ready.get())
+
+def start_loading():
+    """Запускает фоновую загрузку спрайтов, звуков и музыки игры"""
+    assets.loader = AssetLoader(assets, GAME_SPRITES, GAME_SOUNDS, MUSIC)
+    return assets.loader
+
+class TextCache:
+    """LRU-кэш отрендеренного текста по ключу (font, text, color, antialias).
+    
+    Как и у AssetCache, поверхности общие - изменять их нельзя.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            self.misses += 1
+            surface = font.render(text, antialias, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+        return surface
+    
+    def clear(self):
+        self.surfaces.clear()
+    
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.surfaces)}
+
+text_cache = TextCache()
+
+def render_text(font, text, color, antialias=True):
+    """Рендер текста через общий кэш"""
+    return text_cache.render(font, text, color, antialias)
+
+class Label:
+    """Динамическая надпись по шаблону, перерисовывается только при смене значения.
+    
+    Не засоряет общий кэш: хранит у себя только последнюю поверхность.
+    """
+    def __init__(self, font, template, color, antialias=True):
+        self.font = font
+        self.template = template
+        self.color = color
+        self.antialias = antialias
+        self.value = None
+        self.surface = None
+        self.renders = 0
+    
+    def render(self, value):
+        if self.surface is None or value != self.value:
+            self.value = value
+            self.surface = self.font.render(self.template.format(value), self.antialias, self.color)
+            self.renders += 1
+        return self.surface
+
 class Button:
     def __init__(self, x, y, width, height, text, color, hover_color):
         self.rect = pygame.Rect(x, y, width, height)
@@ -72,18 +614,39 @@ class Button:
         self.color = color
         self.hover_color = hover_color
         self.is_hovered = False
+        self.images = {}  # is_hovered -> (готовая поверхность, позиция)
+    
+    def _render(self, hovered):
+        # Длинная надпись может выходить за края кнопки, как и раньше
+        text_surf = render_text(font_medium, self.text, WHITE)
+        bounds = self.rect.union(text_surf.get_rect(center=self.rect.center))
+        image = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        local = self.rect.move(-bounds.x, -bounds.y)
+        pygame.draw.rect(image, self.hover_color if hovered else self.color, local, border_radius=10)
+        pygame.draw.rect(image, WHITE, local, 2, border_radius=10)
+        image.blit(text_surf, text_surf.get_rect(center=local.center))
+        return image, bounds.topleft
     
     def draw(self, surface):
-        color = self.hover_color if self.is_hovered else self.color
-        pygame.draw.rect(surface, color, self.rect, border_radius=10)
-        pygame.draw.rect(surface, WHITE, self.rect, 2, border_radius=10)
-        
-        text_surf = font_medium.render(self.text, True, WHITE)
-        text_rect = text_surf.get_rect(center=self.rect.center)
-        surface.blit(text_surf, text_rect)
+        cached = self.images.get(self.is_hovered)
+        if cached is None:
+            cached = self.images[self.is_hovered] = self._render(self.is_hovered)
+        surface.blit(*cached)
+    
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            self.images.clear()
+    
+    def set_hover(self, pos):
+        """Обновляет подсветку; True, если состояние изменилось"""
+        hovered = self.rect.collidepoint(pos)
+        changed = hovered != self.is_hovered
+        self.is_hovered = hovered
+        return changed
     
     def check_hover(self, pos):
-        self.is_hovered = self.rect.collidepoint(pos)
+        self.set_hover(pos)
         return self.is_hovered
     
     def is_clicked(self, pos, event):
@@ -91,10 +654,138 @@ class Button:
             return self.rect.collidepoint(pos)
         return False
 
+class Overlay:
+    """Полноэкранный оверлей в retained-режиме.
+    
+    Затемнение, надписи и кнопки собираются в один слой, который пересобирается
+    только после invalidate() или смены подсветки кнопок. Проверка нажатий
+    от отрисовки не зависит.
+    """
+    shade = (0, 0, 0, 200)
+    
+    def __init__(self):
+        self.active = False
+        self.buttons = []
+        self.layer = None
+        self.alpha = True
+        self.dirty = True
+    
+    def invalidate(self):
+        self.dirty = True
+    
+    def update_hover(self, pos):
+        for button in self.buttons:
+            if button.set_hover(pos):
+                self.dirty = True
+    
+    def build(self, layer):
+        """Рисует на слое надписи поверх затемнения и кнопок"""
+    
+    def draw(self, surface):
+        alpha = quality.settings["alpha_overlays"]
+        if self.dirty or self.layer is None or self.alpha != alpha:
+            if self.layer is None or self.alpha != alpha:
+                # Без прозрачности слой непрозрачный: дешевле blit, но игры под ним не видно
+                if alpha:
+                    self.layer = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
+                else:
+                    self.layer = pygame.Surface((WIDTH, HEIGHT)).convert()
+                self.alpha = alpha
+            self.layer.fill(self.shade if alpha else self.shade[:3])
+            for button in self.buttons:
+                button.draw(self.layer)
+            self.build(self.layer)
+            self.dirty = False
+        surface.blit(self.layer, (0, 0))
+
+_scaled_images = weakref.WeakKeyDictionary()  # исходная поверхность -> {масштаб: копия}
+
+def scaled_image(image, scale):
+    """image в масштабе scale для кадра пониженного разрешения; копии живут, пока жив оригинал"""
+    if scale == 1.0:
+        return image
+    copies = _scaled_images.setdefault(image, {})
+    scaled = copies.get(scale)
+    if scaled is None:
+        width, height = image.get_size()
+        scaled = copies[scale] = pygame.transform.scale(
+            image, (max(1, round(width * scale)), max(1, round(height * scale))))
+    return scaled
+
+_particle_sprites = []  # вид * PARTICLE_FADE_STEPS + стадия -> спрайт частицы
+
+def particle_sprites():
+    """Общий набор спрайтов частиц: круги цветов PARTICLE_BURSTS, от погасшего к яркому"""
+    if not _particle_sprites:
+        size = 2 * PARTICLE_FADE_STEPS
+        for color, *_ in PARTICLE_BURSTS.values():
+            for stage in range(PARTICLE_FADE_STEPS):
+                sprite = pygame.Surface((size, size), pygame.SRCALPHA)
+                alpha = 255 * (stage + 1) // PARTICLE_FADE_STEPS
+                pygame.draw.circle(sprite, (*color, alpha), (size // 2, size // 2), stage + 1)
+                _particle_sprites.append(sprite)
+    return _particle_sprites
+
+_image_masks = weakref.WeakKeyDictionary()  # поверхность -> маска её непрозрачных пикселей
+
+def image_mask(image):
+    """Маска непрозрачных пикселей image (по colorkey или альфе); строится один раз на поверхность"""
+    mask = _image_masks.get(image)
+    if mask is None:
+        mask = _image_masks[image] = pygame.mask.from_surface(image)
+    return mask
+
+def masks_overlap(mask, pos, other_mask, other_pos):
+    """Точная проверка касания двух масок в мировых координатах их левых верхних углов"""
+    return mask.overlap(other_mask, (other_pos[0] - pos[0], other_pos[1] - pos[1])) is not None
+
+def lerp_pos(prev_pos, rect, alpha):
+    """Позиция для отрисовки между прошлым и текущим шагом симуляции"""
+    return (round(prev_pos[0] + (rect.x - prev_pos[0]) * alpha),
+            round(prev_pos[1] + (rect.y - prev_pos[1]) * alpha))
+
+# Бинарный снимок состояния симуляции (GameScene.snapshot): поля подряд в этом порядке.
+# Флаги заголовка: 1 - рой, 2 - бесконечный мир (тогда вместо платформ - зерно мира).
+SNAPSHOT_MAGIC = b'KBS1'
+SNAPSHOT_HEADER = struct.Struct("<4sBIiddQ")  # магия, флаги, шаг, до автосохранения, камера x/prev_x, зерно
+SNAPSHOT_PLAYER = struct.Struct("<ddiiiiiid???iBBBidi")
+SNAPSHOT_ITEM = struct.Struct("<BI")  # уровень и цена товара магазина
+SNAPSHOT_COUNT = struct.Struct("<H")
+SNAPSHOT_RECT = struct.Struct("<iiii")
+SNAPSHOT_DRONES = struct.Struct("<HH")  # в списке, всего (+ улетевший взламываемый)
+SNAPSHOT_DRONE = struct.Struct("<iiiidd?h")
+SNAPSHOT_SWARM = struct.Struct("<Iq")
+SNAPSHOT_TARGET = struct.Struct("<qq")  # цель игрока и взламываемый дрон: индекс или id в рое, -1 - нет
+SNAPSHOT_HACK = struct.Struct("<H4s?")
+SNAPSHOT_FISH = struct.Struct("<iidd")
+SNAPSHOT_RNG = struct.Struct(f"<B{len(random.Random().getstate()[1])}I?d")
+
+class SnapshotReader:
+    """Последовательное чтение полей снимка"""
+    __slots__ = ("data", "offset")
+    
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+    
+    def read(self, fmt):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+    
+    def take(self, size):
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
 class Player:
     def __init__(self):
-        self.idle_img = load_image('player.png', colorkey=-1, scale=0.8)
+        self.sprites = assets.sprite_set('player.png', colorkey=-1, scale=0.8)
+        self.idle_img = self.sprites.get()[0]
+        self.frame = 0
         self.rect = self.idle_img.get_rect(center=(WIDTH//2, HEIGHT//2))
+        self.x, self.y = float(self.rect.x), float(self.rect.y)
+        self.prev_pos = self.rect.topleft
         self.speed = 7
         self.jump_power = 18
         self.velocity_y = 0
@@ -115,134 +806,481 @@ class Player:
         self.invincible = False
         self.invincible_timer = 0
         self.jumps_left = 1
-        self.platform_rects = []
     
-    def update(self, platforms: List[pygame.Rect]):
+    def _sync_position(self):
+        # rect мог быть сдвинут снаружи - дробная позиция следует за ним
+        if int(self.x) != self.rect.x:
+            self.x = float(self.rect.x)
+        if int(self.y) != self.rect.y:
+            self.y = float(self.rect.y)
+    
+    def move(self, dx):
+        self._sync_position()
+        self.x += dx
+        self.rect.x = int(self.x)
+    
+    def update(self, platforms: "SpatialHash", dt=1.0, left=0, right=WIDTH):
+        self._sync_position()
+        
         # Обновляем таймер неуязвимости
         if self.invincible:
-            self.invincible_timer -= 1
+            self.invincible_timer -= dt
             if self.invincible_timer <= 0:
                 self.invincible = False
         
         # Гравитация
-        self.velocity_y += 0.8
-        self.rect.y += self.velocity_y
-        
-        # Обновляем список rect'ов платформ для оптимизации
-        self.platform_rects = [p.rect for p in platforms] if hasattr(platforms[0], 'rect') else platforms
+        start = self.rect.copy()
+        self.velocity_y += 0.8 * dt
+        self.y += self.velocity_y * dt
+        self.rect.y = int(self.y)
         
-        # Проверка коллизий с оптимизацией
-        hits = []
-        for platform in platforms:
-            if self.rect.colliderect(platform.rect if hasattr(platform, 'rect') else platform):
-                hits.append(platform)
+        # Проверка коллизий только с платформами из соседних ячеек. Берём весь
+        # путь за шаг, иначе при быстром падении платформа проскакивается насквозь
+        dy = self.rect.y - start.y
+        if self.velocity_y > 0 and dy == 0:
+            # Падение меньше пикселя: опору ищем на пиксель ниже, иначе стоящий
+            # игрок через шаг теряет землю, а с ней и второй прыжок
+            dy = 1
+        hits = platforms.query_swept(start, 0, dy)
         
         self.on_ground = False
         for platform in hits:
-            platform_rect = platform.rect if hasattr(platform, 'rect') else platform
-            if self.velocity_y > 0 and abs(self.rect.bottom - platform_rect.top) <= 10:
+            platform_rect = platform.rect
+            if (self.velocity_y > 0 and start.bottom <= platform_rect.top + 10
+                    and self.rect.bottom >= platform_rect.top):
                 self.rect.bottom = platform_rect.top
                 self.on_ground = True
                 self.velocity_y = 0
                 self.jumps_left = 1 + self.upgrades["double_jump"]
                 break
         
-        # Невидимые стены
-        self.rect.left = max(0, self.rect.left)
-        self.rect.right = min(WIDTH, self.rect.right)
+        # Невидимые стены (в бесконечном режиме правой нет)
+        self.rect.left = max(left, self.rect.left)
+        if right is not None:
+            self.rect.right = min(right, self.rect.right)
         self.rect.top = max(0, self.rect.top)
+        self._sync_position()
     
     def take_damage(self, amount):
         if not self.invincible:
             self.health -= amount
             self.invincible = True
             self.invincible_timer = 60  # 1 секунда неуязвимости
-            if DAMAGE_SOUND:
-                DAMAGE_SOUND.play()
+            audio.play("damage")
             return True
         return False
     
-    def draw(self, surface):
-        img = self.idle_img
-        if not self.facing_right:
-            img = pygame.transform.flip(img, True, False)
+    def draw(self, surface, alpha=1.0, shift=0, scale=1.0):
+        img, _ = self.sprites.get(facing_right=self.facing_right, frame=self.frame)
+        
+        x, y = lerp_pos(self.prev_pos, self.rect, alpha)
+        x -= shift
         
         # Мигание при неуязвимости
         if not self.invincible or pygame.time.get_ticks() % 200 < 100:
-            surface.blit(img, self.rect)
+            surface.blit(scaled_image(img, scale), (x * scale, y * scale))
         
         # Полоска здоровья
         health_width = 50
         health_height = 5
-        health_x = self.rect.x + (self.rect.width - health_width) // 2
-        health_y = self.rect.y - 10
+        health_x = x + (self.rect.width - health_width) // 2
+        health_y = y - 10
         
         # Фон полоски
-        pygame.draw.rect(surface, RED, (health_x, health_y, health_width, health_height))
+        pygame.draw.rect(surface, RED, (health_x * scale, health_y * scale,
+                                        health_width * scale, health_height * scale))
         # Текущее здоровье
         current_width = (self.health / self.max_health) * health_width
-        pygame.draw.rect(surface, GREEN, (health_x, health_y, current_width, health_height))
+        pygame.draw.rect(surface, GREEN, (health_x * scale, health_y * scale,
+                                          current_width * scale, health_height * scale))
+    
+    def collision_mask(self):
+        """Маска текущего кадра игрока и её позиция в мире"""
+        image, (dx, dy) = self.sprites.get(facing_right=self.facing_right, frame=self.frame)
+        return image_mask(image), (self.rect.x + dx, self.rect.y + dy)
+    
+    @property
+    def dirty_rect(self):
+        # Спрайт вместе с полоской здоровья, от прошлого шага до текущего
+        rect = self.rect.union(self.rect.move(self.prev_pos[0] - self.rect.x,
+                                              self.prev_pos[1] - self.rect.y))
+        return rect.union((rect.x + (self.rect.width - 50) // 2, rect.y - 10, 50, 5))
+
+class Pool:
+    """Пул переиспользуемых объектов для часто создаваемых сущностей.
+    
+    acquire(*args) достаёт свободный объект и вызывает у него reset(*args),
+    а если свободных нет - создаёт новый через factory(*args). release()
+    возвращает объект в пул. В установившемся режиме спавн и удаление
+    сущностей не выделяют память и не нагружают сборщик мусора.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+        self.in_use = 0
+        self.created = 0
+        self.high_water = 0
+    
+    def acquire(self, *args):
+        if self.free:
+            obj = self.free.pop()
+            obj.reset(*args)
+        else:
+            obj = self.factory(*args)
+            self.created += 1
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return obj
+    
+    def release(self, obj):
+        self.in_use -= 1
+        self.free.append(obj)
+    
+    def stats(self):
+        return {"in_use": self.in_use, "free": len(self.free), "created": self.created,
+                "high_water": self.high_water}
 
 class Drone:
+    __slots__ = ("sprites", "image", "mask", "rect", "x", "prev_pos", "speed", "has_fish", "damage")
+    
     def __init__(self, x, y):
-        self.image = load_image('drone.png', colorkey=-1, scale=0.4)
-        self.rect = self.image.get_rect(center=(x, y))
-        self.speed = random.uniform(1.5, 3.5)
-        self.has_fish = random.random() < 0.3
-        self.damage = 10
-    
-    def update(self):
-        self.rect.x -= self.speed
-        if self.rect.right < 0:
+        self.sprites = assets.sprite_set('drone.png', colorkey=-1, scale=0.4, variants=DRONE_VARIANTS)
+        self.image = self.sprites.get()[0]
+        # Урон наносит только корпус: индикатор рыбы в маску не входит
+        self.mask = image_mask(self.image)
+        self.rect = self.image.get_rect()
+        self.reset(x, y)
+    
+    def reset(self, x, y):
+        self.rect.center = (x, y)
+        self.x = float(self.rect.x)
+        self.prev_pos = self.rect.topleft
+        self.speed = rng.uniform(1.5, 3.5)
+        self.has_fish = rng.random() < DRONE_FISH_CHANCE
+        self.damage = DRONE_DAMAGE
+    
+    def update(self, dt=1.0, left=0):
+        self.prev_pos = self.rect.topleft
+        self.x -= self.speed * dt
+        self.rect.x = int(self.x)
+        if self.rect.right < left:
             return True
         return False
     
-    def draw(self, surface):
-        surface.blit(self.image, self.rect)
+    def draw(self, surface, alpha=1.0, shift=0, scale=1.0):
+        x, y = lerp_pos(self.prev_pos, self.rect, alpha)
+        image, (dx, dy) = self.sprites.get("fish" if self.has_fish else None)
+        surface.blit(scaled_image(image, scale), ((x + dx - shift) * scale, (y + dy) * scale))
+    
+    @property
+    def dirty_rect(self):
+        rect = self.rect.union(self.rect.move(self.prev_pos[0] - self.rect.x, 0))
         if self.has_fish:
-            fish_ind = pygame.Surface((10, 10))
-            fish_ind.fill(GREEN)
-            surface.blit(fish_ind, (self.rect.centerx - 5, self.rect.top - 15))
+            width = rect.width - self.rect.width + 10
+            return rect.union((rect.x + self.rect.width // 2 - 5, rect.top - 15, width, 10))
+        return rect
+
+class SwarmDrone:
+    """Лёгкое представление дрона из DroneSwarm для HackingGame и прицеливания"""
+    __slots__ = ("swarm", "drone_id")
+    
+    def __init__(self, swarm, drone_id):
+        self.swarm = swarm
+        self.drone_id = drone_id
+    
+    def _index(self):
+        return self.swarm.index_of(self.drone_id)
+    
+    @property
+    def rect(self):
+        index = self._index()
+        if index is None:
+            return pygame.Rect(0, 0, 0, 0)
+        return self.swarm.rect_at(index)
+    
+    @property
+    def has_fish(self):
+        index = self._index()
+        return index is not None and bool(self.swarm.has_fish[index])
+    
+    @property
+    def damage(self):
+        index = self._index()
+        return 0 if index is None else int(self.swarm.damage[index])
+
+class DroneSwarm:
+    """Рой дронов в виде структуры массивов NumPy.
+    
+    Позиции, скорости, флаги рыбы и урон лежат в непрерывных массивах,
+    движение, отсев улетевших и проверка касания с игроком выполняются
+    одной векторной операцией на весь рой.
+    """
+    def __init__(self, capacity=SWARM_SIZE):
+        self.sprites = assets.sprite_set('drone.png', colorkey=-1, scale=SWARM_DRONE_SCALE, variants=DRONE_VARIANTS)
+        self.image = self.sprites.get()[0]
+        self.mask = image_mask(self.image)
+        self.fish_image, (_, self.fish_dy) = self.sprites.get("fish")
+        self.width, self.height = self.image.get_size()
+        self.capacity = capacity
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.prev_x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.speed = np.zeros(capacity, dtype=np.float32)
+        self.has_fish = np.zeros(capacity, dtype=bool)
+        self.damage = np.zeros(capacity, dtype=np.int16)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+        self.next_id = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def _arrays(self):
+        return (self.x, self.prev_x, self.y, self.speed, self.has_fish, self.damage, self.ids)
+    
+    def spawn(self, x, y):
+        """Добавляет дрона с центром в (x, y), если в рое есть место"""
+        if self.count >= self.capacity:
+            return False
+        i = self.count
+        self.x[i] = self.prev_x[i] = x - self.width / 2
+        self.y[i] = y - self.height / 2
+        self.speed[i] = rng.uniform(1.5, 3.5)
+        self.has_fish[i] = rng.random() < DRONE_FISH_CHANCE
+        self.damage[i] = DRONE_DAMAGE
+        self.ids[i] = self.next_id
+        self.next_id += 1
+        self.count += 1
+        return True
+    
+    def update(self, player_rect, dt=1.0, left=0):
+        """Сдвигает весь рой и возвращает индексы дронов, касающихся игрока"""
+        n = self.count
+        x = self.x[:n]
+        self.prev_x[:n] = x
+        x -= self.speed[:n] * dt
+        
+        keep = x + self.width >= left
+        if not keep.all():
+            for array in self._arrays():
+                kept = array[:n][keep]
+                array[:len(kept)] = kept
+            n = self.count = int(keep.sum())
+            x = self.x[:n]
+        
+        y = self.y[:n]
+        hits = ((x < player_rect.right) & (x + self.width > player_rect.left) &
+                (y < player_rect.bottom) & (y + self.height > player_rect.top))
+        return np.flatnonzero(hits)
+    
+    def first_touching(self, hits, mask, pos):
+        """Первый из hits (касание по рамкам), чьи пиксели пересекаются с mask в точке pos, или None"""
+        for i in hits.tolist():
+            if masks_overlap(mask, pos, self.mask, (int(self.x[i]), int(self.y[i]))):
+                return i
+        return None
+    
+    def index_of(self, drone_id):
+        found = np.flatnonzero(self.ids[:self.count] == drone_id)
+        return int(found[0]) if found.size else None
+    
+    def rect_at(self, index):
+        return pygame.Rect(int(self.x[index]), int(self.y[index]), self.width, self.height)
+    
+    def view(self, index):
+        return SwarmDrone(self, int(self.ids[index]))
+    
+    def remove(self, drone):
+        index = self.index_of(drone.drone_id)
+        if index is None:
+            return False
+        last = self.count - 1
+        for array in self._arrays():
+            array[index] = array[last]
+        self.count = last
+        return True
+    
+    def snapshot(self):
+        """Живая часть роя для снимка: счётчики и срезы массивов подряд"""
+        n = self.count
+        return SNAPSHOT_SWARM.pack(n, self.next_id) + b"".join(array[:n].tobytes() for array in self._arrays())
+    
+    def restore(self, reader):
+        n, self.next_id = reader.read(SNAPSHOT_SWARM)
+        if n > self.capacity:
+            raise ValueError(f"в снимке {n} дронов, в рое место на {self.capacity}")
+        for array in self._arrays():
+            array[:n] = np.frombuffer(reader.take(n * array.itemsize), dtype=array.dtype)
+        self.count = n
+    
+    def draw(self, surface, alpha=1.0, camera=None, scale=1.0):
+        """Рисует рой одним blits; с camera - только видимых дронов, возвращает их число"""
+        n = self.count
+        prev_x = self.prev_x[:n]
+        x = prev_x + (self.x[:n] - prev_x) * alpha
+        y = self.y[:n]
+        has_fish = self.has_fish[:n]
+        if camera is not None:
+            view = camera.view
+            shown = ((x < view.right) & (x + self.width > view.left) &
+                     (y < view.bottom) & (y + self.height > view.top))
+            x, y, has_fish = x[shown] - (view.x + camera.margin), y[shown], has_fish[shown]
+            camera.drawn += len(x)
+            camera.culled += n - len(x)
+        xs = (x * scale).astype(np.int32).tolist()
+        ys = (y * scale).astype(np.int32).tolist()
+        image, fish_image = scaled_image(self.image, scale), scaled_image(self.fish_image, scale)
+        fish_dy = int(self.fish_dy * scale)
+        surface.blits([(fish_image, (x, y + fish_dy)) if fish else (image, (x, y))
+                       for x, y, fish in zip(xs, ys, has_fish.tolist())], False)
+        return len(xs)
+
+class ParticleSystem:
+    """Частицы эффектов (взлом, рыба, урон) в виде структуры массивов NumPy.
+    
+    Массивы выделены один раз на capacity частиц, новые частицы пишутся по кругу
+    поверх самых старых, так что ни память, ни работа за кадр не растут.
+    Обновление - одна векторная операция, отрисовка - один blits спрайтами из
+    particle_sprites(). Случайность своя, а не rng: эффекты не часть симуляции
+    и не должны сбивать повторы и снимки состояния.
+    """
+    def __init__(self, capacity=PARTICLE_CAPACITY):
+        self.sprites = particle_sprites()
+        self.half = PARTICLE_FADE_STEPS  # половина размера спрайта
+        self.kinds = {kind: i for i, kind in enumerate(PARTICLE_BURSTS)}
+        self.capacity = capacity
+        self.x = np.zeros(capacity, dtype=np.float32)
+        self.y = np.zeros(capacity, dtype=np.float32)
+        self.vx = np.zeros(capacity, dtype=np.float32)
+        self.vy = np.zeros(capacity, dtype=np.float32)
+        self.life = np.zeros(capacity, dtype=np.float32)  # осталось шагов; <= 0 - слот свободен
+        self.max_life = np.ones(capacity, dtype=np.float32)
+        self.color = np.zeros(capacity, dtype=np.uint8)  # индекс вида в PARTICLE_BURSTS
+        self.offsets = np.arange(capacity)
+        self.head = 0  # следующий слот - самая старая частица
+        self.live = 0
+        self.recycled = 0  # живых частиц вытеснено новыми
+        self.random = np.random.default_rng()
+    
+    def __len__(self):
+        return self.live
+    
+    def emit(self, kind, x, y):
+        """Вспышка вида kind из PARTICLE_BURSTS с центром в (x, y) мира"""
+        _, count, speed, lifetime = PARTICLE_BURSTS[kind]
+        count = min(count, self.capacity)
+        slots = (self.head + self.offsets[:count]) % self.capacity
+        self.head = (self.head + count) % self.capacity
+        self.recycled += int(np.count_nonzero(self.life[slots] > 0))
+        angle = self.random.uniform(0, 2 * np.pi, count)
+        velocity = self.random.uniform(0.3, 1.0, count) * speed
+        self.x[slots] = x
+        self.y[slots] = y
+        self.vx[slots] = np.cos(angle) * velocity
+        self.vy[slots] = np.sin(angle) * velocity - speed / 2  # разлёт с подбросом вверх
+        self.life[slots] = self.max_life[slots] = self.random.uniform(0.6, 1.0, count) * lifetime
+        self.color[slots] = self.kinds[kind]
+        self.live = int(np.count_nonzero(self.life > 0))
+    
+    def update(self, dt=1.0):
+        if not self.live:
+            return
+        self.life -= dt
+        self.vy += PARTICLE_GRAVITY * dt
+        self.x += self.vx * dt
+        self.y += self.vy * dt
+        self.live = int(np.count_nonzero(self.life > 0))
+    
+    def clear(self):
+        self.life[:] = 0
+        self.live = 0
+    
+    def bounds(self):
+        """Рамка всех живых частиц в мировых координатах, None - частиц нет"""
+        if not self.live:
+            return None
+        alive = self.life > 0
+        x, y = self.x[alive], self.y[alive]
+        left, top = int(x.min()) - self.half, int(y.min()) - self.half
+        return pygame.Rect(left, top, int(x.max()) + self.half + 1 - left, int(y.max()) + self.half + 1 - top)
+    
+    def draw(self, surface, camera):
+        """Рисует видимые камере частицы одним blits, возвращает их число"""
+        if not self.live:
+            return 0
+        alive = np.flatnonzero(self.life > 0)
+        x, y = self.x[alive], self.y[alive]
+        view = camera.view
+        shown = (x >= view.left) & (x < view.right) & (y >= view.top) & (y < view.bottom)
+        alive = alive[shown]
+        stage = np.minimum(self.life[alive] / self.max_life[alive] * PARTICLE_FADE_STEPS, PARTICLE_FADE_STEPS - 1)
+        index = (self.color[alive].astype(np.int32) * PARTICLE_FADE_STEPS + stage.astype(np.int32)).tolist()
+        xs = (x[shown] - (view.x + camera.margin + self.half)).astype(np.int32).tolist()
+        ys = (y[shown] - self.half).astype(np.int32).tolist()
+        sprites = self.sprites
+        surface.blits([(sprites[i], (x, y)) for i, x, y in zip(index, xs, ys)], False)
+        return len(xs)
 
 class FishReward:
+    __slots__ = ("image", "mask", "rect", "lifetime", "blink_timer")
+    
     def __init__(self, x, y):
         self.image = load_image('fish.png', colorkey=-1, scale=0.5)
-        self.rect = self.image.get_rect(center=(x, y))
+        self.mask = image_mask(self.image)
+        self.rect = self.image.get_rect()
+        self.reset(x, y)
+    
+    def reset(self, x, y):
+        self.rect.center = (x, y)
         self.lifetime = 180
         self.blink_timer = 0
     
-    def update(self):
-        self.lifetime -= 1
-        self.blink_timer = (self.blink_timer + 1) % 10
+    def update(self, dt=1.0):
+        self.lifetime -= dt
+        self.blink_timer = (self.blink_timer + dt) % 10
         return self.lifetime <= 0
     
-    def draw(self, surface):
+    def draw(self, surface, shift=0, scale=1.0):
         # Мерцание в последние 60 кадров
         if self.lifetime > 60 or self.blink_timer < 5:
-            surface.blit(self.image, self.rect)
+            surface.blit(scaled_image(self.image, scale), ((self.rect.x - shift) * scale, self.rect.y * scale))
+    
+    @property
+    def dirty_rect(self):
+        return self.rect
 
 class HackingGame:
+    __slots__ = ("drone", "code", "input", "font", "active", "background", "rect",
+                 "progress_label", "code_label", "input_label")
+    
     def __init__(self, drone):
-        self.drone = drone
-        self.code = str(random.randint(1000, 9999))
-        self.input = ""
         self.font = font_medium
-        self.active = True
         self.background = pygame.Surface((500, 250))
         self.background.fill((30, 30, 50))
+        self.rect = self.background.get_rect(topleft=(WIDTH//2-250, HEIGHT//2-125))
+        self.progress_label = Label(self.font, "Взлом: {}%", WHITE)
+        self.code_label = Label(self.font, "Код: {}", WHITE)
+        self.input_label = Label(self.font, "Ввод: {}", WHITE)
+        self.reset(drone)
+    
+    def reset(self, drone):
+        # Фон и подписи переживают диалог, заново задаётся только состояние взлома
+        self.drone = drone
+        self.code = str(rng.randint(1000, 9999))
+        self.input = ""
+        self.active = True
     
     def draw(self, surface):
-        surface.blit(self.background, (WIDTH//2-250, HEIGHT//2-125))
+        surface.blit(self.background, self.rect)
         
         texts = [
-            f"Взлом: {len(self.input)*25}%",
-            f"Код: {self.code}",
-            f"Ввод: {self.input}",
-            "[ESC] - Отмена"
+            self.progress_label.render(len(self.input)*25),
+            self.code_label.render(self.code),
+            self.input_label.render(self.input),
+            render_text(self.font, "[ESC] - Отмена", WHITE)
         ]
         
-        for i, text in enumerate(texts):
-            text_surf = self.font.render(text, True, WHITE)
+        for i, text_surf in enumerate(texts):
             surface.blit(text_surf, (WIDTH//2 - text_surf.get_width()//2, 
                                   HEIGHT//2 - 100 + i*50))
     
@@ -252,8 +1290,7 @@ class HackingGame:
                 self.active = False
             elif event.key == pygame.K_RETURN:
                 if self.input == self.code:
-                    if HACK_SOUND:
-                        HACK_SOUND.play()
+                    audio.play("hack")
                     return "success"
                 self.input = ""
             elif event.key == pygame.K_BACKSPACE:
@@ -261,99 +1298,106 @@ class HackingGame:
             elif event.unicode.isdigit() and len(self.input) < 4:
                 self.input += event.unicode
 
-class Shop:
+class Shop(Overlay):
     def __init__(self, player):
+        super().__init__()
         self.player = player
-        self.active = False
         self.items = [
             {"name": "Ускорение", "cost": 5, "type": "speed", "level": 0, "max_level": 3, "effect": "+2 к скорости"},
             {"name": "Прыжок", "cost": 5, "type": "jump", "level": 0, "max_level": 3, "effect": "+3 к прыжку"},
             {"name": "Двойной прыжок", "cost": 10, "type": "double_jump", "level": 0, "max_level": 1, "effect": "Позволяет прыгать в воздухе"}
         ]
-        self.buttons = []
+        self.item_buttons = []
         for i, item in enumerate(self.items):
-            self.buttons.append(Button(WIDTH//2 - 150, 200 + i*80, 300, 50, 
-                                     f"{item['name']} - {item['cost']} рыб", 
-                                     PURPLE, BLUE))
+            self.item_buttons.append(Button(WIDTH//2 - 150, 200 + i*80, 300, 50, "", PURPLE, BLUE))
+        self.back_button = Button(WIDTH//2 - 100, HEIGHT - 100, 200, 50, "Назад", RED, PURPLE)
+        self.buttons = self.item_buttons + [self.back_button]
+        self.fish_label = Label(font_medium, "Рыб: {}", WHITE)
+        self.refresh_labels()
     
-    def draw(self, surface):
-        overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 200))
-        surface.blit(overlay, (0, 0))
-        
-        title = font_large.render("МАГАЗИН", True, WHITE)
-        surface.blit(title, (WIDTH//2 - title.get_width()//2, 50))
-        
-        fish_text = font_medium.render(f"Рыб: {self.player.fish_count}", True, WHITE)
-        surface.blit(fish_text, (WIDTH//2 - fish_text.get_width()//2, 120))
-        
-        back_button = Button(WIDTH//2 - 100, HEIGHT - 100, 200, 50, "Назад", RED, PURPLE)
-        back_button.check_hover(pygame.mouse.get_pos())
-        back_button.draw(surface)
+    def refresh_labels(self):
+        """Надписи кнопок товаров по текущим ценам; вызывать после любого изменения items"""
+        for item, button in zip(self.items, self.item_buttons):
+            button.set_text(f"{item['name']} - {item['cost']} рыб")
+        self.invalidate()
+    
+    def build(self, layer):
+        title = render_text(font_large, "МАГАЗИН", WHITE)
+        layer.blit(title, (WIDTH//2 - title.get_width()//2, 50))
         
-        for i, (button, item) in enumerate(zip(self.buttons, self.items)):
-            button.draw(surface)
-            level_text = font_small.render(f"Ур. {item['level']}/{item['max_level']}", True, WHITE)
-            effect_text = font_small.render(item["effect"], True, YELLOW)
-            surface.blit(level_text, (WIDTH//2 + 160, 215 + i*80))
-            surface.blit(effect_text, (WIDTH//2 - 140, 245 + i*80))
+        fish_text = self.fish_label.render(self.player.fish_count)
+        layer.blit(fish_text, (WIDTH//2 - fish_text.get_width()//2, 120))
         
-        return back_button
+        for i, item in enumerate(self.items):
+            level_text = render_text(font_small, f"Ур. {item['level']}/{item['max_level']}", WHITE)
+            effect_text = render_text(font_small, item["effect"], YELLOW)
+            layer.blit(level_text, (WIDTH//2 + 160, 215 + i*80))
+            layer.blit(effect_text, (WIDTH//2 - 140, 245 + i*80))
     
-    def handle_event(self, event):
-        mouse_pos = pygame.mouse.get_pos()
-        back_button = self.draw(pygame.display.get_surface())
+    def draw(self, surface):
+        if self.fish_label.value != self.player.fish_count:
+            self.invalidate()
+        super().draw(surface)
+    
+    def handle_event(self, event, mouse_pos=None):
+        if mouse_pos is None:
+            mouse_pos = pygame.mouse.get_pos()
+        self.update_hover(mouse_pos)
         
-        if back_button.is_clicked(mouse_pos, event):
+        if self.back_button.is_clicked(mouse_pos, event):
             self.active = False
         
-        for button, item in zip(self.buttons, self.items):
-            button.check_hover(mouse_pos)
-            
+        for button, item in zip(self.item_buttons, self.items):
             if button.is_clicked(mouse_pos, event):
-                if (self.player.fish_count >= item["cost"] and 
-                    item["level"] < item["max_level"]):
-                    
-                    self.player.fish_count -= item["cost"]
-                    item["level"] += 1
-                    item["cost"] = int(item["cost"] * 1.5)  # Увеличиваем стоимость
-                    
-                    if item["type"] == "speed":
-                        self.player.speed += 2
-                    elif item["type"] == "jump":
-                        self.player.jump_power += 3
-                    elif item["type"] == "double_jump":
-                        self.player.upgrades["double_jump"] = 1
-                        self.player.jumps_left = 2
-
-class GameMenu:
+                self.buy(item)
+    
+    def buy(self, item):
+        """Покупка улучшения; False, если не хватает рыбы или уровень максимальный"""
+        if self.player.fish_count < item["cost"] or item["level"] >= item["max_level"]:
+            return False
+        
+        self.player.fish_count -= item["cost"]
+        item["level"] += 1
+        item["cost"] = int(item["cost"] * SHOP_COST_GROWTH)  # Увеличиваем стоимость
+        self.refresh_labels()
+        self.player.upgrades[item["type"]] = item["level"]
+        
+        if item["type"] == "speed":
+            self.player.speed += 2
+        elif item["type"] == "jump":
+            self.player.jump_power += 3
+        elif item["type"] == "double_jump":
+            self.player.upgrades["double_jump"] = 1
+            self.player.jumps_left = 2
+        return True
+
+class GameMenu(Overlay):
     def __init__(self, player):
-        self.active = False
+        super().__init__()
         self.player = player
         self.buttons = [
             Button(WIDTH//2 - 150, HEIGHT//2 - 60, 300, 50, "Продолжить", GREEN, BLUE),
             Button(WIDTH//2 - 150, HEIGHT//2 + 20, 300, 50, "Магазин", PURPLE, DARK_BLUE),
             Button(WIDTH//2 - 150, HEIGHT//2 + 100, 300, 50, "Выйти в меню", RED, PURPLE)
         ]
+        self.fish_label = Label(font_medium, "Рыб: {}", WHITE)
     
-    def draw(self, surface):
-        overlay = pygame.Surface((WIDTH, HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 200))
-        surface.blit(overlay, (0, 0))
-        
-        title = font_large.render("ПАУЗА", True, WHITE)
-        surface.blit(title, (WIDTH//2 - title.get_width()//2, HEIGHT//4))
+    def build(self, layer):
+        title = render_text(font_large, "ПАУЗА", WHITE)
+        layer.blit(title, (WIDTH//2 - title.get_width()//2, HEIGHT//4))
         
-        fish_text = font_medium.render(f"Рыб: {self.player.fish_count}", True, WHITE)
-        surface.blit(fish_text, (WIDTH//2 - fish_text.get_width()//2, HEIGHT//4 + 100))
-        
-        for button in self.buttons:
-            button.draw(surface)
+        fish_text = self.fish_label.render(self.player.fish_count)
+        layer.blit(fish_text, (WIDTH//2 - fish_text.get_width()//2, HEIGHT//4 + 100))
     
-    def handle_event(self, event):
-        mouse_pos = pygame.mouse.get_pos()
-        for button in self.buttons:
-            button.check_hover(mouse_pos)
+    def draw(self, surface):
+        if self.fish_label.value != self.player.fish_count:
+            self.invalidate()
+        super().draw(surface)
+    
+    def handle_event(self, event, mouse_pos=None):
+        if mouse_pos is None:
+            mouse_pos = pygame.mouse.get_pos()
+        self.update_hover(mouse_pos)
         
         if self.buttons[0].is_clicked(mouse_pos, event):
             self.active = False
@@ -372,72 +1416,426 @@ class Platform(pygame.sprite.Sprite):
         self.image.fill(GRAY)
         self.rect = self.image.get_rect(topleft=(x, y))
 
+# Полосы высот для платформ: внутри полосы платформы не пересекаются по x,
+# а сами полосы не пересекаются по y
+PLATFORM_LANES = ((HEIGHT//2, HEIGHT//2 + 110), (HEIGHT//2 + 150, HEIGHT - 100))
+
+def place_platforms(rand, left, right, count, min_width=150, max_width=300, height=20):
+    """Раскладывает count платформ в [left, right) за один проход, без повторов.
+    
+    Платформы по очереди раздаются полосам PLATFORM_LANES. В полосе сначала
+    выбираются ширины, затем свободное место случайно делится на промежутки
+    между ними (упаковка интервалов), поэтому пересечений не бывает.
+    """
+    lanes = [[] for _ in PLATFORM_LANES]
+    for i in range(count):
+        lanes[i % len(lanes)].append(rand.randint(min_width, max_width))
+    
+    rects = []
+    span = right - left
+    for (top, bottom), widths in zip(PLATFORM_LANES, lanes):
+        total = sum(widths)
+        if total > span:
+            # Не помещаются - ужимаем пропорционально
+            widths = [width * span // total for width in widths]
+            total = sum(widths)
+        cuts = sorted(rand.randint(0, span - total) for _ in widths)
+        x = left
+        for cut, width in zip(cuts, widths):
+            rects.append((x + cut, rand.randint(top, bottom), width, height))
+            x += width
+    return rects
+
 def generate_platforms():
     platforms = []
     # Пол
     platforms.append(Platform(0, HEIGHT-40, WIDTH, 40))
+    for rect in place_platforms(rng, 50, WIDTH - 50, 5):
+        platforms.append(Platform(*rect))
+    return platforms
+
+def generate_chunk(seed, index):
+    """Платформы чанка index; зависят только от (seed, index), годится для любого потока"""
+    rand = random.Random(f"{seed}:{index}")
+    left = index * CHUNK_WIDTH
+    rects = [(left, HEIGHT - 40, CHUNK_WIDTH, 40)]
+    rects += place_platforms(rand, left + 50, left + CHUNK_WIDTH - 50, PLATFORMS_PER_CHUNK)
+    return rects
+
+class ChunkStreamer:
+    """Бесконечный мир из чанков шириной CHUNK_WIDTH.
+    
+    Чанки впереди камеры генерируются в рабочем потоке, на главном остаётся
+    создать платформы, внести их в сетку столкновений и нарисовать в слой -
+    не больше одного чанка за кадр, кроме видимых, которых дожидаемся.
+    Чанки позади камеры выгружаются, поэтому память и работа за кадр
+    не зависят от пройденного расстояния.
+    """
+    def __init__(self, seed, grid, layer):
+        self.seed = seed
+        self.grid = grid
+        self.layer = layer
+        self.chunks = {}  # номер -> [Platform]
+        self.requested = set()
+        self.platforms = []
+        self.requests = queue.Queue()
+        self.ready = queue.Queue()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
     
-    for i in range(5):
+    def _work(self):
         while True:
-            width = random.randint(150, 300)
-            height = 20
-            x = random.randint(50, WIDTH - width - 50)
-            y = random.randint(HEIGHT//2, HEIGHT - 100)
-            
-            new_platform = Platform(x, y, width, height)
-            
-            intersects = False
-            for platform in platforms:
-                if new_platform.rect.colliderect(platform.rect):
-                    intersects = True
-                    break
-            
-            if not intersects:
-                platforms.append(new_platform)
+            index = self.requests.get()
+            if index is None:
                 break
+            self.ready.put((index, generate_chunk(self.seed, index)))
     
-    return platforms
+    def update(self, camera_x):
+        first = int(camera_x // CHUNK_WIDTH)
+        visible = range(first, first + 2)
+        keep = range(first - CHUNKS_BEHIND, first + 2 + CHUNKS_AHEAD)
+        for index in keep:
+            if index not in self.chunks and index not in self.requested:
+                self.requested.add(index)
+                self.requests.put(index)
+        
+        while any(index not in self.chunks for index in visible):
+            self._install(*self.ready.get())
+        try:
+            self._install(*self.ready.get_nowait())
+        except queue.Empty:
+            pass
+        
+        for index in [index for index in self.chunks if index not in keep]:
+            self._evict(index)
+    
+    def _install(self, index, rects):
+        self.requested.discard(index)
+        platforms = [Platform(*rect) for rect in rects]
+        for platform in platforms:
+            self.grid.insert(platform, platform.rect)
+        self.chunks[index] = platforms
+        self.layer.add_chunk(index, platforms)
+        self._collect()
+    
+    def _evict(self, index):
+        for platform in self.chunks.pop(index):
+            self.grid.remove(platform)
+        self.layer.remove_chunk(index)
+        self._collect()
+    
+    def _collect(self):
+        self.platforms = [platform for index in sorted(self.chunks) for platform in self.chunks[index]]
+    
+    def unload(self):
+        """Выгружает все чанки из сетки и слоя - перед заменой мира другим"""
+        for index in list(self.chunks):
+            self._evict(index)
+    
+    def close(self):
+        self.requests.put(None)
 
-def show_main_menu():
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    pygame.display.set_caption("КиберБарсик 2045 - Меню")
+class Camera:
+    """Горизонтальная камера: мировые координаты -> экранные, плюс отсечение.
     
-    title = font_large.render("КИБЕРБАРСИК 2045", True, WHITE)
-    start_button = Button(WIDTH//2 - 100, HEIGHT//2, 200, 50, "Начать игру", GREEN, BLUE)
-    exit_button = Button(WIDTH//2 - 100, HEIGHT//2 + 70, 200, 50, "Выход", RED, PURPLE)
+    В бесконечном режиме следует за игроком только вперёд, как в раннере;
+    в обычном стоит на месте. Сдвиг для отрисовки интерполируется между
+    шагами симуляции так же, как позиции спрайтов. Всё, что не пересекает
+    экран с запасом CULL_MARGIN, не рисуется - счётчики drawn/culled
+    сбрасываются в begin_frame().
+    """
+    def __init__(self, x=0.0, margin=CULL_MARGIN):
+        self.x = self.prev_x = float(x)
+        self.view = pygame.Rect(-margin, -margin, WIDTH + 2 * margin, HEIGHT + 2 * margin)
+        self.margin = margin
+        self.drawn = 0
+        self.culled = 0
     
-    # Загрузка сохранения
-    try:
-        with open('save.json', 'r') as f:
-            save_data = json.load(f)
-        save_text = font_medium.render(f"Рекорд: {save_data.get('fish', 0)} рыб", True, YELLOW)
-    except:
-        save_text = font_medium.render("Рекорд: нет данных", True, YELLOW)
-    
-    running = True
-    while running:
-        screen.fill(BLACK)
-        
-        mouse_pos = pygame.mouse.get_pos()
-        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            
-            if start_button.is_clicked(mouse_pos, event):
-                return "start"
-            if exit_button.is_clicked(mouse_pos, event):
-                pygame.quit()
-                sys.exit()
-        
-        screen.blit(title, (WIDTH//2 - title.get_width()//2, HEIGHT//4))
-        screen.blit(save_text, (WIDTH//2 - save_text.get_width()//2, HEIGHT//4 + 100))
-        start_button.draw(screen)
-        exit_button.draw(screen)
-        
-        pygame.display.flip()
-        pygame.time.Clock().tick(FPS)
+    def follow(self, rect):
+        self.prev_x = self.x
+        self.x = max(self.x, float(rect.centerx - WIDTH // 3))
+    
+    def shift(self, alpha=1.0):
+        return round(self.prev_x + (self.x - self.prev_x) * alpha)
+    
+    def begin_frame(self, alpha=1.0):
+        """Сдвиг камеры на этот кадр; видимая область мира сдвигается вместе с ним"""
+        shift = self.shift(alpha)
+        self.view.x = shift - self.margin
+        self.drawn = 0
+        self.culled = 0
+        return shift
+    
+    def visible(self, rect):
+        if self.view.colliderect(rect):
+            self.drawn += 1
+            return True
+        self.culled += 1
+        return False
+    
+    def cull(self, entities):
+        """Только видимые из entities (по их rect)"""
+        return [entity for entity in entities if self.visible(entity.rect)]
+
+class SpatialHash:
+    """Равномерная сетка для broadphase-проверок столкновений.
+    
+    Статичные объекты регистрируются один раз через insert(), движущиеся
+    обновляются через update() - ячейки пересчитываются, только если объект
+    перешёл в другие ячейки. Запросы возвращают объекты в порядке вставки.
+    """
+    def __init__(self, cell_size=COLLISION_CELL):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}  # obj -> (rect, границы ячеек)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, obj):
+        return obj in self.entries
+    
+    def _bounds(self, rect):
+        size = self.cell_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size, (rect.bottom - 1) // size)
+    
+    def _cells(self, bounds):
+        x0, y0, x1, y1 = bounds
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                yield (cx, cy)
+    
+    def insert(self, obj, rect):
+        rect = pygame.Rect(rect)
+        bounds = self._bounds(rect)
+        for cell in self._cells(bounds):
+            self.cells.setdefault(cell, {})[obj] = None
+        self.entries[obj] = (rect, bounds)
+    
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if entry is None:
+            return False
+        for cell in self._cells(entry[1]):
+            bucket = self.cells[cell]
+            del bucket[obj]
+            if not bucket:
+                del self.cells[cell]
+        return True
+    
+    def update(self, obj, rect):
+        entry = self.entries.get(obj)
+        rect = pygame.Rect(rect)
+        if entry is None or self._bounds(rect) != entry[1]:
+            self.remove(obj)
+            self.insert(obj, rect)
+        else:
+            self.entries[obj] = (rect, entry[1])
+    
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+    
+    def _candidates(self, rect):
+        found = {}
+        for cell in self._cells(self._bounds(rect)):
+            bucket = self.cells.get(cell)
+            if bucket:
+                found.update(bucket)
+        return found
+    
+    def query_point(self, pos):
+        size = self.cell_size
+        bucket = self.cells.get((int(pos[0]) // size, int(pos[1]) // size), {})
+        return [obj for obj in bucket if self.entries[obj][0].collidepoint(pos)]
+    
+    def query_rect(self, rect):
+        rect = pygame.Rect(rect)
+        return [obj for obj in self._candidates(rect) if rect.colliderect(self.entries[obj][0])]
+    
+    def query_swept(self, rect, dx, dy):
+        """Объекты, которых коснётся rect при сдвиге на (dx, dy), по времени касания"""
+        start = pygame.Rect(rect)
+        hits = []
+        for obj in self._candidates(start.union(start.move(dx, dy))):
+            t = _sweep_time(start, dx, dy, self.entries[obj][0])
+            if t is not None:
+                hits.append((t, obj))
+        hits.sort(key=lambda hit: hit[0])
+        return [obj for t, obj in hits]
+
+def _sweep_time(rect, dx, dy, target):
+    """Доля пути [0, 1], на которой движущийся rect начинает пересекать target"""
+    t_entry, t_exit = float("-inf"), float("inf")
+    for lo, hi, t_lo, t_hi, d in ((rect.left, rect.right, target.left, target.right, dx),
+                                  (rect.top, rect.bottom, target.top, target.bottom, dy)):
+        if d == 0:
+            if hi <= t_lo or lo >= t_hi:
+                return None
+            continue
+        t1 = (t_lo - hi) / d
+        t2 = (t_hi - lo) / d
+        t_entry = max(t_entry, min(t1, t2))
+        t_exit = min(t_exit, max(t1, t2))
+    if t_entry >= t_exit or t_entry > 1 or t_exit < 0:
+        return None
+    return max(t_entry, 0.0)
+
+class LevelLayer:
+    """Статичный слой уровня: фон и платформы, запечённые в одну поверхность.
+    
+    Слой собирается один раз на уровень в формате дисплея и пересобирается,
+    только когда get() получает другой список платформ.
+    """
+    def __init__(self, background, platform_texture=None):
+        self.background = background
+        self.platform_texture = platform_texture
+        self.platforms = None
+        self.surface = None
+        self.tiles = {}  # высота -> отмасштабированная текстура
+        self.builds = 0
+    
+    def get(self, platforms):
+        if self.surface is None or platforms is not self.platforms:
+            self.build(platforms)
+        return self.surface
+    
+    def build(self, platforms):
+        surface = self.background.convert()
+        for platform in platforms:
+            surface.blit(platform.image, platform.rect)
+            if self.platform_texture is not None:
+                self._blit_texture(surface, platform.rect)
+        self.platforms = platforms
+        self.surface = surface
+        self.builds += 1
+        return surface
+    
+    def _blit_texture(self, surface, rect):
+        # Текстура подгоняется по высоте и повторяется по ширине платформы
+        tile = self.tiles.get(rect.height)
+        if tile is None:
+            tex_w, tex_h = self.platform_texture.get_size()
+            width = max(1, tex_w * rect.height // tex_h)
+            tile = pygame.transform.smoothscale(self.platform_texture, (width, rect.height))
+            self.tiles[rect.height] = tile
+        width = tile.get_width()
+        for x in range(rect.left, rect.right, width):
+            surface.blit(tile, (x, rect.top), (0, 0, min(width, rect.right - x), rect.height))
+
+class ChunkedLevelLayer(LevelLayer):
+    """Слой бесконечного мира: фон плюс полосы с платформами загруженных чанков.
+    
+    Платформы чанка рисуются в его полосу один раз при загрузке, полосы
+    выгруженных чанков переиспользуются. get() пересобирает экранный слой,
+    только когда сдвинулась камера или сменился набор чанков.
+    """
+    BAND_TOP = PLATFORM_LANES[0][0]  # Выше платформ не бывает
+    COLORKEY = (255, 0, 255)
+    
+    def __init__(self, background, platform_texture=None):
+        super().__init__(background, platform_texture)
+        self.bands = {}  # номер чанка -> полоса
+        self.free = []
+        self.camera_x = None
+    
+    def add_chunk(self, index, platforms):
+        band = self.free.pop() if self.free else pygame.Surface((CHUNK_WIDTH, HEIGHT - self.BAND_TOP)).convert()
+        band.fill(self.COLORKEY)
+        left = index * CHUNK_WIDTH
+        for platform in platforms:
+            rect = platform.rect.move(-left, -self.BAND_TOP)
+            band.blit(platform.image, rect)
+            if self.platform_texture is not None:
+                self._blit_texture(band, rect)
+        band.set_colorkey(self.COLORKEY, pygame.RLEACCEL)
+        self.bands[index] = band
+        self.camera_x = None
+    
+    def remove_chunk(self, index):
+        self.free.append(self.bands.pop(index))
+        self.camera_x = None
+    
+    def get(self, camera_x):
+        if self.surface is None or camera_x != self.camera_x:
+            self.build(camera_x)
+        return self.surface
+    
+    def build(self, camera_x):
+        if self.surface is None:
+            self.surface = self.background.convert()
+        else:
+            self.surface.blit(self.background, (0, 0))
+        for index, band in self.bands.items():
+            x = index * CHUNK_WIDTH - camera_x
+            if -CHUNK_WIDTH < x < WIDTH:
+                self.surface.blit(band, (x, self.BAND_TOP))
+        self.camera_x = camera_x
+        self.builds += 1
+        return self.surface
+
+class DirtyRectRenderer:
+    """Перерисовка только изменившихся областей экрана вместо blit фона + flip.
+    
+    Каждый кадр: mark() для текущих областей спрайтов, restore() восстанавливает
+    фон под ними и под прошлым кадром, после отрисовки present() отправляет
+    на экран только эти области. invalidate() - полная перерисовка следующего кадра.
+    mark_static() - для неподвижного (HUD): область обновляется только в том кадре,
+    где её перерисовали, и в следующем не восстанавливается.
+    """
+    def __init__(self, background, enabled=False):
+        self.background = background
+        self.enabled = enabled
+        self.prev_rects = []
+        self.rects = []
+        self.static_rects = []
+        self.full_redraw = True
+    
+    def invalidate(self):
+        self.full_redraw = True
+        self.rects = []
+        self.static_rects = []
+    
+    def set_background(self, background):
+        self.background = background
+        self.invalidate()
+    
+    def mark(self, rect):
+        self.rects.append(pygame.Rect(rect))
+    
+    def mark_static(self, rect):
+        self.static_rects.append(pygame.Rect(rect))
+    
+    def restore(self, surface):
+        if self.full_redraw:
+            surface.blit(self.background, (0, 0))
+            return
+        for rect in self.prev_rects + self.rects + self.static_rects:
+            surface.blit(self.background, rect, rect)
+    
+    def present(self):
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            pygame.display.update(self.prev_rects + self.rects + self.static_rects)
+        self.prev_rects = self.rects
+        self.rects = []
+        self.static_rects = []
+
+def draw_loading_bar(surface, progress):
+    """Полоса загрузки ассетов под кнопками меню"""
+    bar = pygame.Rect(WIDTH//2 - 150, HEIGHT//2 + 220, 300, 16)
+    pygame.draw.rect(surface, (40, 40, 60), bar, border_radius=8)
+    fill = bar.copy()
+    fill.width = int(bar.width * progress)
+    pygame.draw.rect(surface, GREEN, fill, border_radius=8)
+    pygame.draw.rect(surface, WHITE, bar, 1, border_radius=8)
+    text = render_text(font_small, f"Загрузка {int(progress * 100)}%", WHITE)
+    surface.blit(text, (WIDTH//2 - text.get_width()//2, bar.bottom + 5))
+
+fish_counter_label = Label(font_medium, "x {}", WHITE)
 
 def draw_fish_counter(surface, count):
     counter_bg = pygame.Rect(20, 20, 200, 60)
@@ -447,184 +1845,1655 @@ def draw_fish_counter(surface, count):
     fish_icon = load_image('fish.png', colorkey=-1, scale=0.4)
     surface.blit(fish_icon, (30, 30))
     
-    count_text = font_medium.render(f"x {count}", True, WHITE)
+    count_text = fish_counter_label.render(count)
     surface.blit(count_text, (80, 35))
+    return counter_bg
 
 def draw_controls(surface):
-    controls_text = font_small.render("WASD - движение | H - взлом | ESC - меню", True, WHITE)
-    surface.blit(controls_text, (10, HEIGHT - 30))
+    controls_text = render_text(font_small, "WASD - движение | H - взлом | ESC - меню", WHITE)
+    return surface.blit(controls_text, (10, HEIGHT - 30))
+
+def _migrate_v1(data):
+    # v1 - исходный формат без версии: уровни магазина не сохранялись
+    data.setdefault("upgrades", {"speed": 0, "jump": 0, "double_jump": 0})
+    data.setdefault("shop", {})
+    return data
+
+# Версия записи -> функция, поднимающая её до следующей версии
+SAVE_MIGRATIONS = {1: _migrate_v1}
+
+class SaveService:
+    """Сохранение игры: снимок на главном потоке, запись в фоновом.
+    
+    Файл пишется во временный, сбрасывается на диск (fsync) и атомарно
+    подменяет старый, так что падение посреди записи его не портит.
+    Последняя запись кэшируется в памяти, повторные load() диск не читают.
+    """
+    def __init__(self, path=SAVE_PATH):
+        self.path = path
+        self.record = None
+        self.loaded = False
+        self.writes = 0
+        self.queue = queue.Queue()
+        self.thread = None
+    
+    @staticmethod
+    def migrate(data):
+        version = data.get("version", 1)
+        if version > SAVE_VERSION:
+            raise ValueError(f"версия сохранения {version} новее игры")
+        while version < SAVE_VERSION:
+            data = SAVE_MIGRATIONS[version](data)
+            version += 1
+        data["version"] = version
+        return data
+    
+    @staticmethod
+    def validate(data):
+        """Проверяет типы полей записи текущей версии; ValueError - запись испорчена"""
+        for name in ("fish", "health"):
+            if not isinstance(data.get(name, 0), int):
+                raise ValueError(f"поле {name} не число")
+        upgrades = data.get("upgrades", {})
+        if not isinstance(upgrades, dict) or not all(isinstance(level, int) for level in upgrades.values()):
+            raise ValueError("поле upgrades не словарь уровней")
+        shop = data.get("shop", {})
+        if not isinstance(shop, dict):
+            raise ValueError("поле shop не словарь")
+        for kind, state in shop.items():
+            if not (isinstance(state, dict) and isinstance(state.get("level"), int)
+                    and isinstance(state.get("cost"), int)):
+                raise ValueError(f"товар {kind} без уровня или цены")
+        return data
+    
+    def load(self):
+        """Последнее сохранение (после миграции) или None"""
+        if not self.loaded:
+            self.loaded = True
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("запись не является объектом JSON")
+                self.record = self.validate(self.migrate(data))
+            except FileNotFoundError:
+                self.record = None
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Не удалось загрузить сохранение: {e}")
+                self.record = None
+        return self.record
+    
+    def save(self, record):
+        """Кэширует запись и ставит её в очередь на запись, не блокируя кадр"""
+        record["version"] = SAVE_VERSION
+        self.record = record
+        self.loaded = True
+        self.queue.put(json.dumps(record, ensure_ascii=False))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._writer, daemon=True)
+            self.thread.start()
+    
+    def flush(self):
+        """Дожидается записи всех сохранений из очереди"""
+        if self.thread is not None:
+            self.queue.join()
+    
+    def _writer(self):
+        while True:
+            text = self.queue.get()
+            # Если успело накопиться несколько снимков, пишем только последний
+            skipped = 0
+            while not self.queue.empty():
+                text = self.queue.get_nowait()
+                skipped += 1
+            try:
+                self._write(text)
+            except OSError as e:
+                print(f"Не удалось сохранить игру: {e}")
+            finally:
+                for _ in range(skipped + 1):
+                    self.queue.task_done()
+    
+    def _write(self, text):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.writes += 1
 
-def save_game(player):
-    data = {
+saves = SaveService()
+
+def save_game(player, shop):
+    saves.save({
         "fish": player.fish_count,
-        "upgrades": player.upgrades,
-        "health": player.health
-    }
-    with open('save.json', 'w') as f:
-        json.dump(data, f)
+        "upgrades": dict(player.upgrades),
+        "health": player.health,
+        "shop": {item["type"]: {"level": item["level"], "cost": item["cost"]} for item in shop.items},
+    })
 
-def load_game(player):
-    try:
-        with open('save.json', 'r') as f:
-            data = json.load(f)
-            player.fish_count = data.get("fish", 0)
-            player.upgrades = data.get("upgrades", {"speed": 0, "jump": 0, "double_jump": 0})
-            player.health = data.get("health", 100)
+def load_game(player, shop):
+    data = saves.load()
+    if data is None:
+        return
+    player.fish_count = data.get("fish", 0)
+    player.upgrades.update(data.get("upgrades", {}))
+    player.health = data.get("health", 100)
+    
+    # Уровни и выросшие цены магазина; в старых сохранениях - по улучшениям игрока
+    shop_state = data.get("shop", {})
+    for item in shop.items:
+        state = shop_state.get(item["type"])
+        if state is not None:
+            item["level"], item["cost"] = state["level"], state["cost"]
+        else:
+            for _ in range(player.upgrades.get(item["type"], 0)):
+                item["level"] += 1
+                item["cost"] = int(item["cost"] * SHOP_COST_GROWTH)
+        player.upgrades[item["type"]] = item["level"]
+    shop.refresh_labels()
+    
+    # Применяем улучшения
+    player.speed = 7 + 2 * player.upgrades["speed"]
+    player.jump_power = 18 + 3 * player.upgrades["jump"]
+    player.jumps_left = 1 + player.upgrades["double_jump"]
+
+class LiveInput:
+    """Ввод с настоящих клавиатуры и мыши"""
+    def events(self):
+        return pygame.event.get()
+    
+    def pressed(self):
+        return pygame.key.get_pressed()
+    
+    def mouse_pos(self):
+        return pygame.mouse.get_pos()
+    
+    def wait(self, timeout_ms):
+        """Блокирует до первого события или timeout_ms; возвращает все накопившиеся"""
+        event = pygame.event.wait(timeout_ms)
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event] + pygame.event.get()
+
+class HeldKeys(set):
+    """Множество зажатых клавиш с интерфейсом pygame.key.get_pressed()"""
+    def __getitem__(self, key):
+        return key in self
+
+class ScriptedInput:
+    """Заранее записанный ввод для headless-прогонов.
+    
+    events - {номер кадра: [события]}, held - [(первый кадр, последний кадр, клавиша)].
+    Позиция мыши берётся из pos последнего события мыши.
+    """
+    def __init__(self, events=None, held=()):
+        self.script = events or {}
+        self.held = list(held)
+        self.frame = -1
+        self.pos = (0, 0)
+    
+    def events(self):
+        self.frame += 1
+        pygame.event.pump()
+        events = self.script.get(self.frame, [])
+        for event in events:
+            if hasattr(event, "pos"):
+                self.pos = event.pos
+        return events
+    
+    def wait(self, timeout_ms):
+        # Скрипт не ждёт: кадр без событий просто проходит
+        return self.events()
+    
+    def pressed(self):
+        return HeldKeys(key for first, last, key in self.held if first <= self.frame <= last)
+    
+    def mouse_pos(self):
+        return self.pos
+
+def coalesce_motion(events):
+    """Из движений мыши за кадр оставляет последнее: подсветке кнопок нужна только итоговая позиция"""
+    last = None
+    for event in events:
+        if event.type == pygame.MOUSEMOTION:
+            last = event
+    if last is None:
+        return events
+    return [event for event in events if event.type != pygame.MOUSEMOTION or event is last]
+
+def key_event(key, unicode=""):
+    return pygame.event.Event(pygame.KEYDOWN, key=key, unicode=unicode, mod=0, scancode=0)
+
+def click_event(pos):
+    return pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1)
+
+def motion_event(pos):
+    return pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(0, 0), buttons=(0, 0, 0))
+
+class FixedClock:
+    """Часы без ожидания: каждый кадр длится ровно step_ms (один шаг симуляции)"""
+    def __init__(self, step_ms=1000 / SIM_HZ):
+        self.step_ms = step_ms
+    
+    def tick(self, framerate=0):
+        return self.step_ms
+
+class FrameTimings:
+    """Время фаз кадра по отметкам: lap(name) относит время с прошлой отметки к name"""
+    def __init__(self):
+        self.totals = {}
+        self.current = {}
+        self.last_frame = {}
+        self.frames = 0
+        self.last = time.perf_counter()
+    
+    def begin_frame(self):
+        self.current = {}
+        self.last = time.perf_counter()
+    
+    def lap(self, name):
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0.0) + now - self.last
+        self.last = now
+    
+    def end_frame(self):
+        for name, value in self.current.items():
+            self.totals[name] = self.totals.get(name, 0.0) + value
+        self.last_frame = self.current
+        self.frames += 1
+    
+    def frame_ms(self):
+        """Длительность последнего завершённого кадра в миллисекундах"""
+        return sum(self.last_frame.values()) * 1000
+    
+    def averages(self, grouped=False):
+        """Среднее время фаз в миллисекундах на кадр; grouped - по префиксу до точки"""
+        frames = max(1, self.frames)
+        result = {}
+        for name, total in self.totals.items():
+            if grouped:
+                name = name.split(".")[0]
+            result[name] = result.get(name, 0.0) + total * 1000 / frames
+        return result
+
+class QualityGovernor:
+    """Адаптивное качество графики под бюджет кадра 1000 / FPS.
+    
+    record() копит время работы кадра (без ожидания часов) в скользящем окне.
+    Перцентиль выше down_ms опускает качество на уровень, как только набралась
+    четверть окна; вверх уровень идёт только после полного окна ниже up_ms.
+    Зазор между порогами и медленный подъём - гистерезис против качелей.
+    Каждая смена уровня печатается и остаётся в changes.
+    """
+    def __init__(self, levels=QUALITY_LEVELS, window=QUALITY_WINDOW, percentile=QUALITY_PERCENTILE,
+                 down_ms=QUALITY_DOWN_MS, up_ms=QUALITY_UP_MS, fixed=None):
+        self.levels = levels
+        self.samples = deque(maxlen=window)
+        self.percentile = percentile
+        self.down_ms = down_ms
+        self.up_ms = up_ms
+        self.start_level = 0
+        if fixed is not None:
+            try:
+                self.start_level = min(max(int(fixed), 0), len(levels) - 1)
+            except ValueError:
+                print(f"Уровень качества {fixed!r} - не номер от 0 до {len(levels) - 1}, регулятор включён")
+                fixed = None
+        self.enabled = fixed is None
+        self.reset()
+    
+    def reset(self):
+        self.level = self.start_level
+        self.samples.clear()
+        self.changes = []  # (кадр, старый уровень, новый уровень, мс)
+        self.frames = 0
+    
+    @property
+    def settings(self):
+        return self.levels[self.level]
+    
+    def percentile_ms(self):
+        samples = sorted(self.samples)
+        return samples[int(len(samples) * self.percentile) - 1] if samples else 0.0
+    
+    def record(self, timings):
+        self.frames += 1
+        if not self.enabled:
+            return
+        self.samples.append(timings.frame_ms() - timings.last_frame.get("wait", 0.0) * 1000)
+        if len(self.samples) < self.samples.maxlen // 4:
+            return
+        ms = self.percentile_ms()
+        if ms > self.down_ms and self.level < len(self.levels) - 1:
+            self.set_level(self.level + 1, ms)
+        elif ms < self.up_ms and self.level > 0 and len(self.samples) == self.samples.maxlen:
+            self.set_level(self.level - 1, ms)
+    
+    def set_level(self, level, ms=0.0):
+        old, self.level = self.level, level
+        # Замеры старого уровня к новому не относятся
+        self.samples.clear()
+        self.changes.append((self.frames, old, level, round(ms, 2)))
+        print(f"Качество: {self.levels[old]['name']} -> {self.levels[level]['name']} "
+              f"(p{round(self.percentile * 100)} {ms:.1f} мс, кадр {self.frames})")
+
+quality = QualityGovernor(fixed=QUALITY_FIXED)
+
+# Фазы кадра игры в порядке выполнения
+PROFILE_PHASES = (
+    "events", "input", "update.player", "update.drones", "collision.drones",
+    "update.fish", "collision.fish", "update.particles", "update.world", "render.level", "render.entities",
+    "render.particles", "render.hud", "render.overlay", "present", "wait",
+)
+TELEMETRY_COUNTERS = ("drones", "fishes", "platforms", "asset_hits", "asset_misses", "text_hits",
+                      "audio_busy", "audio_dropped", "drawn", "culled", "pool_drones", "pool_fishes",
+                      "quality", "particles")
+
+class DebugOverlay:
+    """Оверлей профилировщика: время кадра, график и гистограмма, счётчики, фазы.
+    
+    Текст перерисовывается раз в refresh кадров, график - каждый кадр.
+    """
+    BUDGET_MS = 1000 / FPS
+    GRAPH_MAX_MS = 50
+    
+    def __init__(self, history=240, refresh=15):
+        self.active = False
+        self.history = deque(maxlen=history)
+        self.refresh = refresh
+        self.frame = 0
+        self.lines = []
+        self.font = pygame.font.Font(None, 24)
+        self.rect = pygame.Rect(WIDTH - 330, 10, 320, 560)
+        self.panel = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self.panel.fill((0, 0, 0, 170))
+    
+    def toggle(self):
+        self.active = not self.active
+    
+    def record(self, timings):
+        self.history.append(timings.frame_ms())
+    
+    def _build_lines(self, timings, counts):
+        history = sorted(self.history)
+        p99 = history[int(len(history) * 0.99) - 1] if history else 0.0
+        last = self.history[-1] if self.history else 0.0
+        texts = [
+            f"кадр {last:5.1f} мс  p99 {p99:5.1f} мс",
+            " ".join(f"{name} {value}" for name, value in counts.items()
+                     if name in ("drones", "fishes", "platforms")),
+            f"ассеты {counts['asset_hits']}/{counts['asset_misses']}  текст {counts['text_hits']}",
+            f"звук: каналов {counts['audio_busy']}  отброшено {counts['audio_dropped']}",
+            f"камера: видно {counts['drawn']}  отсечено {counts['culled']}",
+            f"пулы, пик: дроны {counts['pool_drones']}  рыбы {counts['pool_fishes']}",
+            f"частицы {counts['particles']}",
+            f"качество: {quality.levels[counts['quality']]['name']}",
+        ]
+        for name in PROFILE_PHASES:
+            value = timings.last_frame.get(name)
+            if value is not None:
+                texts.append(f"{name}: {value * 1000:.2f} мс")
+        self.lines = [self.font.render(text, True, WHITE) for text in texts]
+    
+    def draw(self, surface, timings, counts):
+        if not self.active:
+            return None
+        if self.frame % self.refresh == 0 or not self.lines:
+            self._build_lines(timings, counts)
+        self.frame += 1
+        
+        if quality.settings["alpha_overlays"]:
+            surface.blit(self.panel, self.rect)
+        else:
+            surface.fill(BLACK, self.rect)
+        x, y = self.rect.x + 10, self.rect.y + 5
+        for line in self.lines:
+            surface.blit(line, (x, y))
+            y += 18
+        
+        # График времени кадра с линией бюджета
+        graph = pygame.Rect(x, self.rect.bottom - 70, self.rect.width - 20, 60)
+        scale = graph.height / self.GRAPH_MAX_MS
+        budget_y = graph.bottom - self.BUDGET_MS * scale
+        pygame.draw.line(surface, YELLOW, (graph.left, budget_y), (graph.right, budget_y))
+        if len(self.history) > 1:
+            step = graph.width / (self.history.maxlen - 1)
+            points = [(graph.left + i * step, graph.bottom - min(ms, self.GRAPH_MAX_MS) * scale)
+                      for i, ms in enumerate(self.history)]
+            pygame.draw.lines(surface, GREEN, False, points)
+        
+        # Гистограмма по 5 мс
+        buckets = [0] * 10
+        for ms in self.history:
+            buckets[min(int(ms // 5), 9)] += 1
+        top = max(buckets) or 1
+        bar_w = graph.width // len(buckets)
+        for i, count in enumerate(buckets):
+            height = 30 * count // top
+            color = GREEN if (i + 1) * 5 <= self.BUDGET_MS else RED
+            pygame.draw.rect(surface, color, (graph.left + i * bar_w, graph.top - 5 - height, bar_w - 2, height))
+        return self.rect
+
+class TelemetryRecorder:
+    """Пофреймовая телеметрия в CSV или JSON lines.
+    
+    Кадры копятся в кольцевом буфере и пачками уходят в фоновый поток записи.
+    Если запись не успевает, буфер вытесняет старые кадры (счётчик dropped).
+    """
+    def __init__(self, path, capacity=2048, flush_every=120):
+        self.path = path
+        self.csv = path.endswith(".csv")
+        self.buffer = deque(maxlen=capacity)
+        self.flush_every = flush_every
+        self.frames = 0
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=4)
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+    
+    def record(self, timings, counts):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        phases = timings.last_frame
+        self.buffer.append((self.frames, time.time(), [phases.get(name, 0.0) for name in PROFILE_PHASES],
+                            [counts[name] for name in TELEMETRY_COUNTERS]))
+        self.frames += 1
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+    
+    def flush(self):
+        if self.buffer and not self.queue.full():
+            self.queue.put_nowait(list(self.buffer))
+            self.buffer.clear()
+    
+    def close(self):
+        if self.thread.is_alive():
+            self.flush()
+            self.queue.put(None)
+            self.thread.join()
+    
+    def _format(self, frame, stamp, phases, counters):
+        frame_ms = sum(phases) * 1000
+        if self.csv:
+            values = [frame, f"{stamp:.3f}", f"{frame_ms:.3f}"]
+            values += [f"{value * 1000:.3f}" for value in phases] + counters
+            return ",".join(map(str, values)) + "\n"
+        record = {"frame": frame, "time": round(stamp, 3), "frame_ms": round(frame_ms, 3)}
+        record.update((name, round(value * 1000, 3)) for name, value in zip(PROFILE_PHASES, phases))
+        record.update(zip(TELEMETRY_COUNTERS, counters))
+        return json.dumps(record) + "\n"
+    
+    def _writer(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            if self.csv:
+                f.write(",".join(("frame", "time", "frame_ms") + PROFILE_PHASES + TELEMETRY_COUNTERS) + "\n")
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    break
+                f.writelines(self._format(*row) for row in batch)
+                f.flush()
+
+# Файл повтора: заголовок, затем записи подряд. Кадр - шаги симуляции, зажатые A/D (биты 1/2),
+# уровень качества и клавиши, дошедшие до игры. Ключевой кадр - снимок состояния перед
+# клавишами кадра с этим номером; forced - состояние изменилось вне симуляции
+# (магазин, перемотка), и при просмотре снимок применяется обязательно.
+REPLAY_MAGIC = b'KBR1'
+REPLAY_HEADER = struct.Struct("<4sBH")  # магия, флаги режима как в снимке, SIM_HZ
+REPLAY_FRAME = struct.Struct("<cBBBH")
+REPLAY_KEY = struct.Struct("<iH")  # код клавиши, символ
+REPLAY_KEYFRAME = struct.Struct("<cI?I")  # номер кадра, forced, длина снимка
+
+class ReplayRecorder:
+    """Запись забега в файл повтора: ввод по кадрам плюс периодические ключевые кадры.
+    
+    Файл сбрасывается на диск на каждом ключевом кадре, поэтому после падения
+    игры в нём остаётся всё до последнего ключевого кадра.
+    """
+    def __init__(self, path, keyframe_every=REPLAY_KEYFRAME_FRAMES):
+        self.file = open(path, 'wb')
+        self.keyframe_every = keyframe_every
+        self.frames = 0
+        self.keys = []
+    
+    def start(self, scene):
+        flags = (scene.drone_swarm is not None) | (scene.streamer is not None) << 1
+        self.file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, flags, SIM_HZ))
+        self.keyframe(scene, forced=True)
+    
+    def key(self, event):
+        self.keys.append((event.key, ord(event.unicode) if event.unicode else 0))
+    
+    def frame(self, steps, held, level):
+        self.file.write(REPLAY_FRAME.pack(b'F', steps, held, level, len(self.keys)))
+        for key in self.keys:
+            self.file.write(REPLAY_KEY.pack(*key))
+        self.keys.clear()
+        self.frames += 1
+    
+    def end_frame(self, scene):
+        if self.frames % self.keyframe_every == 0:
+            self.keyframe(scene)
+    
+    def keyframe(self, scene, forced=False):
+        data = scene.snapshot()
+        self.file.write(REPLAY_KEYFRAME.pack(b'K', self.frames, forced, len(data)))
+        self.file.write(data)
+        self.file.flush()
+        if forced:
+            # Нажатия до этого момента уже вошли в снимок
+            self.keys.clear()
+    
+    def close(self):
+        self.file.close()
+
+class Replay:
+    """Прочитанный файл повтора: кадры ввода и индекс ключевых кадров для перемотки.
+    
+    Оборванная запись (игра упала) читается до последней целой записи.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        magic, flags, sim_hz = REPLAY_HEADER.unpack_from(self.data)
+        if magic != REPLAY_MAGIC:
+            raise ValueError(f"{path} - не файл повтора")
+        if sim_hz != SIM_HZ:
+            raise ValueError(f"повтор записан при SIM_HZ={sim_hz}, в игре {SIM_HZ}")
+        self.swarm = bool(flags & 1)
+        self.endless = bool(flags & 2)
+        self.frames = []  # (шаги, зажатые клавиши, уровень качества, ((клавиша, символ), ...))
+        self.keyframes = {}  # номер кадра -> (forced, смещение, длина)
+        offset = REPLAY_HEADER.size
+        try:
+            while offset < len(self.data):
+                tag = self.data[offset:offset + 1]
+                if tag == b'F':
+                    _, steps, held, level, count = REPLAY_FRAME.unpack_from(self.data, offset)
+                    offset += REPLAY_FRAME.size
+                    keys = tuple(REPLAY_KEY.unpack_from(self.data, offset + i * REPLAY_KEY.size)
+                                 for i in range(count))
+                    offset += count * REPLAY_KEY.size
+                    self.frames.append((steps, held, level, keys))
+                elif tag == b'K':
+                    _, frame, forced, length = REPLAY_KEYFRAME.unpack_from(self.data, offset)
+                    offset += REPLAY_KEYFRAME.size
+                    if offset + length > len(self.data):
+                        break
+                    self.keyframes[frame] = (forced, offset, length)
+                    offset += length
+                else:
+                    raise ValueError(f"повреждённая запись по смещению {offset}")
+        except struct.error:
+            pass
+        self.keyframe_frames = sorted(self.keyframes)
+    
+    def snapshot(self, frame):
+        _, offset, length = self.keyframes[frame]
+        return self.data[offset:offset + length]
+    
+    def keyframe_before(self, frame):
+        """Номер ближайшего ключевого кадра не позже frame"""
+        return self.keyframe_frames[max(0, bisect.bisect_right(self.keyframe_frames, frame) - 1)]
+
+class ReplayInput:
+    """Ввод для просмотра повтора: записанные клавиши, зажатые кнопки и шаги по кадрам.
+    
+    Подключается к GameScene как scene.playback и к SceneManager как controls.
+    С живого ввода берётся только закрытие окна. После последнего кадра
+    повтор завершает run(). verify - сверять состояние с ключевыми кадрами;
+    кадры с расхождением копятся в mismatches.
+    """
+    def __init__(self, replay, scene, verify=False):
+        self.replay = replay
+        self.scene = scene
+        self.verify = verify
+        self.mismatches = []
+        self.frame = -1
+        scene.playback = self
+    
+    def events(self):
+        self.frame += 1
+        events = pygame.event.get(pygame.QUIT)
+        if self.frame >= len(self.replay.frames):
+            return events or [pygame.event.Event(pygame.QUIT)]
+        keyframe = self.replay.keyframes.get(self.frame)
+        if keyframe is not None:
+            if keyframe[0]:
+                self.scene.restore(self.replay.snapshot(self.frame))
+            elif self.verify and self.scene.snapshot() != self.replay.snapshot(self.frame):
+                self.mismatches.append(self.frame)
+        keys = self.replay.frames[self.frame][3]
+        return events + [key_event(key, chr(char) if char else "") for key, char in keys]
+    
+    def wait(self, timeout_ms):
+        return self.events()
+    
+    def pressed(self):
+        held = self.replay.frames[self.frame][1]
+        return HeldKeys(key for bit, key in ((1, pygame.K_a), (2, pygame.K_d)) if held & bit)
+    
+    def mouse_pos(self):
+        return (0, 0)
+    
+    def frame_steps(self):
+        """Шаги симуляции и уровень качества текущего кадра"""
+        steps, _, level, _ = self.replay.frames[self.frame]
+        return steps, level
+    
+    def seek(self, frame):
+        """Переходит к началу кадра frame: ключевой кадр перед ним и досчёт без отрисовки"""
+        frame = max(0, min(frame, len(self.replay.frames)))
+        start = self.replay.keyframe_before(frame)
+        self.scene.restore(self.replay.snapshot(start))
+        self.frame = start - 1
+        manager = self.scene.manager
+        while self.frame < frame - 1 and manager.stack:
+            for event in self.events():
+                manager.dispatch(event)
+            self.scene.update(0)
+
+class Scene:
+    """Экран игры в стеке SceneManager.
+    
+    enter/exit вызываются при входе в стек и уходе из него, suspend/resume - когда
+    сверху кладут непрозрачную сцену и когда её снимают. idle - сцена меняется
+    только от ввода: менеджер спит до события вместо перерисовки. passthrough -
+    сцена лежит поверх предыдущей: та продолжает обновляться, рисуется под ней
+    и получает события, которые эта сцена не обработала.
+    
+    События приходят только тех типов, на которые сцена подписалась через
+    subscribe(); остальные типы, пока сцена на экране, даже не попадают
+    в очередь событий.
+    """
+    idle = False
+    passthrough = False
+    
+    def __init__(self):
+        self.manager = None
+        self.handlers = {}  # тип события -> обработчик
+    
+    def subscribe(self, event_type, handler):
+        """handler(event) для событий event_type; True - событие обработано и ниже по стеку не передаётся"""
+        self.handlers[event_type] = handler
+        if self.manager is not None:
+            self.manager.subscribers = None
+    
+    def enter(self):
+        pass
+    
+    def exit(self):
+        pass
+    
+    def suspend(self):
+        pass
+    
+    def resume(self):
+        pass
+    
+    def handle_event(self, event):
+        """True - событие обработано и ниже по стеку не передаётся"""
+        handler = self.handlers.get(event.type)
+        return handler is not None and bool(handler(event))
+    
+    def update(self, dt):
+        pass
+    
+    def draw(self, surface):
+        pass
+    
+    def present(self):
+        pygame.display.flip()
+    
+    def end_frame(self, timings):
+        pass
+
+class SceneManager:
+    """Стек сцен с общими окном, вводом, часами и замерами кадра.
+    
+    routes - {имя: фабрика сцены} для goto(). Имя без фабрики завершает run()
+    и возвращается из него - так headless-прогон main_game отдаёт "menu".
+    render=False - только логика, без отрисовки (симулятор баланса).
+    
+    Стек - он же стек фокуса ввода: событие идёт обработчикам его типа от
+    верхнего слоя вниз до первого, который его обработал. Таблица обработчиков
+    и фильтр очереди событий (set_allowed) пересобираются только при смене стека,
+    так что цена события не растёт с числом слоёв и подписок.
+    """
+    def __init__(self, controls=None, clock=None, timings=None, routes=None, render=True):
+        self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
+        self.controls = controls if controls is not None else LiveInput()
+        self.clock = clock if clock is not None else pygame.time.Clock()
+        self.timings = timings if timings is not None else FrameTimings()
+        self.routes = routes or {}
+        self.render = render
+        self.stack = []
+        self.result = None
+        self.redraw = True
+        self.subscribers = None  # тип события -> обработчики слоёв сверху вниз; None - пересобрать
+    
+    def _enter(self, scene):
+        scene.manager = self
+        self.stack.append(scene)
+        self.subscribers = None
+        scene.enter()
+        self.redraw = True
+    
+    def push(self, scene):
+        if self.stack and not scene.passthrough:
+            self.stack[-1].suspend()
+        self._enter(scene)
+    
+    def pop(self):
+        scene = self.stack.pop()
+        self.subscribers = None
+        scene.exit()
+        if self.stack and not scene.passthrough:
+            self.stack[-1].resume()
+        self.redraw = True
+        return scene
+    
+    def replace(self, scene):
+        """Меняет верхнюю сцену; сцена под ней остаётся приостановленной"""
+        self.stack.pop().exit()
+        self._enter(scene)
+    
+    def clear(self):
+        self.subscribers = None
+        while self.stack:
+            self.stack.pop().exit()
+    
+    def goto(self, name):
+        """Снимает весь стек и открывает сцену из routes"""
+        self.clear()
+        factory = self.routes.get(name)
+        if factory is None:
+            self.result = name
+        else:
+            self._enter(factory())
+    
+    def quit(self):
+        self.clear()
+        self.result = "exit"
+    
+    def layers(self):
+        """Сцены, которые сейчас обновляются и рисуются, снизу вверх"""
+        start = len(self.stack) - 1
+        while start > 0 and self.stack[start].passthrough:
+            start -= 1
+        return self.stack[start:]
+    
+    def _subscribe(self):
+        subscribers = {}
+        for scene in reversed(self.layers()):
+            for event_type, handler in scene.handlers.items():
+                subscribers.setdefault(event_type, []).append(handler)
+        self.subscribers = subscribers
+        # Типы, которые никто из слоёв не слушает, в очередь не попадают
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(list(subscribers) + list(SYSTEM_EVENTS))
+    
+    def dispatch(self, event):
+        if self.subscribers is None:
+            self._subscribe()
+        for handler in self.subscribers.get(event.type, ()):
+            if handler(event):
+                break
+    
+    def run(self, max_frames=None):
+        timings = self.timings
+        frames = 0
+        dt = 0
+        while self.stack:
+            timings.begin_frame()
+            if self.subscribers is None:
+                # Фильтр очереди действует при её наполнении - обновляем до чтения событий
+                self._subscribe()
+            if self.stack[-1].idle and not self.redraw:
+                # Статичная сцена: спим до ввода, а не рисуем одно и то же
+                events = self.controls.wait(IDLE_WAIT_MS)
+            else:
+                events = self.controls.events()
+            events = coalesce_motion(events)
+            for event in events:
+                if event.type == pygame.QUIT:
+                    self.quit()
+                if not self.stack:
+                    break
+                self.dispatch(event)
+            timings.lap("events")
+            if not self.stack:
+                break
             
-            # Применяем улучшения
-            player.speed = 7 + 2 * player.upgrades["speed"]
-            player.jump_power = 18 + 3 * player.upgrades["jump"]
-            player.jumps_left = 1 + player.upgrades["double_jump"]
-    except:
-        print("Не удалось загрузить сохранение")
-
-def main_game():
-    screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    pygame.display.set_caption("КиберБарсик 2045")
-    clock = pygame.time.Clock()
-    
-    background = load_image('background.jpg')
-    background = pygame.transform.scale(background, (WIDTH, HEIGHT))
-    platform_img = load_image('platform.png')
-    
-    player = Player()
-    load_game(player)  # Загружаем сохранение
-    
-    platforms = generate_platforms()
-    drones = []
-    fishes = []
-    hacking_game = None
-    shop = Shop(player)
-    game_menu = GameMenu(player)
-    
-    running = True
-    while running:
-        mouse_pos = pygame.mouse.get_pos()
-        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                save_game(player)
-                running = False
+            for scene in self.layers():
+                if scene.manager is self:
+                    scene.update(dt)
+            if not self.stack:
+                break
             
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE and not hacking_game:
-                    game_menu.active = not game_menu.active
-                    shop.active = False
-                
-                if not game_menu.active and not shop.active:
-                    if event.key == pygame.K_w and (player.on_ground or player.jumps_left > 0):
-                        player.velocity_y = -player.jump_power
-                        if not player.on_ground:
-                            player.jumps_left -= 1
-                        if JUMP_SOUND:
-                            JUMP_SOUND.play()
-                    if event.key == pygame.K_h and player.target_drone and not player.hacking:
-                        hacking_game = HackingGame(player.target_drone)
-                        player.hacking = True
+            layers = self.layers()
+            if self.render and (self.redraw or events or not layers[-1].idle):
+                for scene in layers:
+                    scene.draw(self.screen)
+                timings.lap("render.overlay")
+                layers[0].present()
+                self.redraw = False
+            timings.lap("present")
+            dt = self.clock.tick(FPS)
+            timings.lap("wait")
+            timings.end_frame()
+            for scene in layers:
+                scene.end_frame(timings)
             
-            if shop.active:
-                shop.handle_event(event)
-            elif game_menu.active:
-                result = game_menu.handle_event(event)
-                if result == "continue":
-                    game_menu.active = False
-                elif result == "shop":
-                    game_menu.active = False
-                    shop.active = True
-                elif result == "main_menu":
-                    save_game(player)
-                    return "menu"
-            elif hacking_game:
-                result = hacking_game.handle_event(event)
-                if result == "success":
-                    if hacking_game.drone.has_fish:
-                        fishes.append(FishReward(hacking_game.drone.rect.centerx, 
-                                               hacking_game.drone.rect.centery))
-                    drones.remove(hacking_game.drone)
-                    hacking_game = None
-                    player.hacking = False
-        
-        if not shop.active and not game_menu.active and not player.hacking:
-            keys = pygame.key.get_pressed()
+            frames += 1
+            if max_frames is not None and frames >= max_frames:
+                self.quit()
+        pygame.event.set_allowed(None)
+        return self.result
+
+class MainMenuScene(Scene):
+    """Главное меню; пока ассеты грузятся в фоне - с полосой загрузки"""
+    first_frame = True  # Время до первого кадра печатается один раз за запуск
+    
+    def __init__(self, loader=None):
+        super().__init__()
+        self.loader = loader
+        self.title = render_text(font_large, "КИБЕРБАРСИК 2045", WHITE)
+        self.start_button = Button(WIDTH//2 - 100, HEIGHT//2, 200, 50, "Начать игру", GREEN, BLUE)
+        self.endless_button = Button(WIDTH//2 - 100, HEIGHT//2 + 70, 200, 50, "Бесконечный забег", BLUE, DARK_BLUE)
+        self.exit_button = Button(WIDTH//2 - 100, HEIGHT//2 + 140, 200, 50, "Выход", RED, PURPLE)
+        self.save_text = None
+        self.subscribe(pygame.MOUSEBUTTONDOWN, self.on_click)
+    
+    @property
+    def idle(self):
+        # Пока идёт загрузка, полоса прогресса обновляется каждый кадр
+        return self.loader is None or self.loader.done
+    
+    def enter(self):
+        pygame.display.set_caption("КиберБарсик 2045 - Меню")
+        # Сохранение читается с диска один раз, дальше берётся из памяти
+        save_data = saves.load()
+        if save_data is not None:
+            self.save_text = render_text(font_medium, f"Рекорд: {save_data.get('fish', 0)} рыб", YELLOW)
+        else:
+            self.save_text = render_text(font_medium, "Рекорд: нет данных", YELLOW)
+    
+    def on_click(self, event):
+        for button, route in ((self.start_button, "start"), (self.endless_button, "endless")):
+            if button.is_clicked(event.pos, event):
+                if self.loader is not None:
+                    self.loader.finish()
+                self.manager.goto(route)
+                return True
+        if self.exit_button.is_clicked(event.pos, event):
+            self.manager.quit()
+        return True
+    
+    def update(self, dt):
+        if self.loader is not None and not self.loader.done:
+            self.loader.pump()
+            if self.loader.done:
+                print(f"Ассеты загружены за {(self.loader.finished_at - START_TIME) * 1000:.0f} мс")
+    
+    def draw(self, surface):
+        surface.fill(BLACK)
+        surface.blit(self.title, (WIDTH//2 - self.title.get_width()//2, HEIGHT//4))
+        surface.blit(self.save_text, (WIDTH//2 - self.save_text.get_width()//2, HEIGHT//4 + 100))
+        self.start_button.draw(surface)
+        self.endless_button.draw(surface)
+        self.exit_button.draw(surface)
+        if self.loader is not None and not self.loader.done:
+            draw_loading_bar(surface, self.loader.progress)
+    
+    def present(self):
+        pygame.display.flip()
+        if MainMenuScene.first_frame:
+            MainMenuScene.first_frame = False
+            print(f"Первый кадр через {(time.perf_counter() - START_TIME) * 1000:.0f} мс после запуска")
+
+class PauseScene(Scene):
+    """Меню паузы поверх замороженного кадра игры"""
+    idle = True
+    
+    def __init__(self, game, backdrop=None):
+        super().__init__()
+        self.game = game
+        self.menu = game.game_menu
+        self.backdrop = backdrop
+        self.subscribe(pygame.KEYDOWN, self.on_key)
+        self.subscribe(pygame.MOUSEMOTION, self.on_motion)
+        self.subscribe(pygame.MOUSEBUTTONDOWN, self.on_click)
+    
+    def enter(self):
+        # Игра приостановлена - её последний кадр служит фоном, пока открыто меню
+        if self.backdrop is None:
+            self.backdrop = self.manager.screen.copy()
+        self.menu.active = True
+    
+    def exit(self):
+        self.menu.active = False
+    
+    def on_key(self, event):
+        if event.key == pygame.K_ESCAPE:
+            self.manager.pop()
+        return True
+    
+    def on_motion(self, event):
+        self.menu.update_hover(event.pos)
+        return True
+    
+    def on_click(self, event):
+        result = self.menu.handle_event(event, event.pos)
+        if result == "continue":
+            self.manager.pop()
+        elif result == "shop":
+            self.manager.replace(ShopScene(self.game, self.backdrop))
+        elif result == "main_menu":
+            self.manager.goto("menu")
+        return True
+    
+    def draw(self, surface):
+        surface.blit(self.backdrop, (0, 0))
+        self.menu.draw(surface)
+
+class ShopScene(Scene):
+    """Магазин улучшений поверх замороженного кадра игры"""
+    idle = True
+    
+    def __init__(self, game, backdrop):
+        super().__init__()
+        self.game = game
+        self.shop = game.shop
+        self.backdrop = backdrop
+        self.subscribe(pygame.KEYDOWN, self.on_key)
+        self.subscribe(pygame.MOUSEMOTION, self.on_motion)
+        self.subscribe(pygame.MOUSEBUTTONDOWN, self.on_click)
+    
+    def enter(self):
+        self.shop.active = True
+    
+    def exit(self):
+        self.shop.active = False
+    
+    def on_key(self, event):
+        if event.key == pygame.K_ESCAPE:
+            # Как и раньше, ESC из магазина возвращает в меню паузы, а не в игру
+            self.manager.replace(PauseScene(self.game, self.backdrop))
+        return True
+    
+    def on_motion(self, event):
+        self.shop.update_hover(event.pos)
+        return True
+    
+    def on_click(self, event):
+        self.shop.handle_event(event, event.pos)
+        if not self.shop.active:
+            self.manager.pop()
+        return True
+    
+    def draw(self, surface):
+        surface.blit(self.backdrop, (0, 0))
+        self.shop.draw(surface)
+
+class HackingScene(Scene):
+    """Диалог взлома дрона; игра под ним продолжает идти"""
+    passthrough = True
+    
+    def __init__(self, game, hacking_game):
+        super().__init__()
+        self.game = game
+        self.hacking_game = hacking_game
+        self.success = False
+        self.subscribe(pygame.KEYDOWN, self.on_key)
+    
+    def exit(self):
+        self.game.end_hack(self.success)
+    
+    def on_key(self, event):
+        if self.hacking_game.handle_event(event) == "success":
+            self.success = True
+        if self.success or not self.hacking_game.active:
+            self.manager.pop()
+        # Остальные клавиши (прыжок, F3) достаются игре
+        consumed = (event.key in (pygame.K_ESCAPE, pygame.K_RETURN, pygame.K_BACKSPACE)
+                    or event.unicode.isdigit())
+        if consumed:
+            self.game.record_key(event)
+        return consumed
+    
+    def draw(self, surface):
+        self.game.renderer.mark(self.hacking_game.rect)
+        self.hacking_game.draw(surface)
+
+class GameScene(Scene):
+    """Забег: уровень, игрок, дроны и рыбы.
+    
+    Всё состояние живёт в сцене, поэтому пауза, магазин и взлом открываются
+    поверх неё без повторной настройки уровня и загрузки ассетов.
+    """
+    def __init__(self, dirty_rects=DIRTY_RECTS, swarm=False, persistent=True, telemetry=None, endless=False,
+                 replay=None):
+        super().__init__()
+        self.persistent = persistent
+        self.telemetry = telemetry
+        self.recorder = ReplayRecorder(replay) if replay else None  # Запись повтора в файл replay
+        self.playback = None  # ReplayInput, когда сцена показывает повтор
+        
+        assets.preload(GAME_SPRITES)
+        background = load_image('background.jpg', size=(WIDTH, HEIGHT))
+        platform_img = load_image('platform.png')
+        
+        self.player = Player()
+        
+        self.platform_grid = SpatialHash()
+        self.camera = Camera()
+        self.streamer = None
+        if endless:
+            # Бесконечный режим: мир из чанков, камера едет за игроком
+            self.level_layer = ChunkedLevelLayer(background, platform_img)
+            self.streamer = ChunkStreamer(rng.getrandbits(32), self.platform_grid, self.level_layer)
+            self.streamer.update(self.camera.x)
+            self.platforms = self.streamer.platforms
+            self.renderer = DirtyRectRenderer(self.level_layer.get(self.camera.shift()), dirty_rects)
+        else:
+            self.platforms = generate_platforms()
+            self.level_layer = LevelLayer(background, platform_img)
+            self.renderer = DirtyRectRenderer(self.level_layer.get(self.platforms), dirty_rects)
+            for platform in self.platforms:
+                self.platform_grid.insert(platform, platform.rect)
+        self.drones = []
+        self.fishes = []
+        self.drone_grid = SpatialHash()
+        self.fish_grid = SpatialHash()
+        self.drone_swarm = None
+        if swarm:
+            if np is None:
+                print("Режим роя требует NumPy")
+            else:
+                self.drone_swarm = DroneSwarm()
+        self.particles = ParticleSystem() if np is not None else None  # Без NumPy - без эффектов
+        self.hacking_game = None
+        self.drone_pool = Pool(Drone)
+        self.fish_pool = Pool(FishReward)
+        self.hacking_pool = Pool(HackingGame)
+        self.shop = Shop(self.player)
+        self.game_menu = GameMenu(self.player)
+        self.debug_overlay = DebugOverlay()
+        if persistent:
+            load_game(self.player, self.shop)  # Загружаем сохранение
+        
+        self.step_ms = 1000 / SIM_HZ
+        self.accumulator = self.step_ms
+        self.alpha = 0.0
+        self.autosave_steps = AUTOSAVE_SECONDS * SIM_HZ
+        self.resumed = False
+        self.step_index = 0  # Шагов симуляции с начала забега
+        self.history = deque(maxlen=REWIND_SECONDS * SIM_HZ // REWIND_EVERY)  # (шаг, снимок) для перемотки
+        self.partial = False
+        self.counts = None
+        self.frame = 0
+        self.hud_rects = []
+        self.low_surface = None  # Кадр мира в пониженном разрешении
+        self.low_background = None
+        self.low_source = None
+        self.subscribe(pygame.KEYDOWN, self.on_key)
+    
+    def enter(self):
+        pygame.display.set_caption("КиберБарсик 2045")
+        if self.recorder is not None:
+            self.recorder.start(self)
+    
+    def exit(self):
+        if self.persistent:
+            save_game(self.player, self.shop)
+        if self.streamer is not None:
+            self.streamer.close()
+        if self.recorder is not None:
+            self.recorder.close()
+    
+    def resume(self):
+        # Время, проведённое в паузе или магазине, симуляция не догоняет
+        self.resumed = True
+        self.renderer.invalidate()
+        if self.recorder is not None:
+            # В магазине могли что-то купить - повтору нужно новое состояние
+            self.recorder.keyframe(self, forced=True)
+    
+    def on_key(self, event):
+        player = self.player
+        if event.key == DEBUG_OVERLAY_KEY:
+            self.debug_overlay.toggle()
+            self.renderer.invalidate()
+        elif event.key == pygame.K_ESCAPE:
+            self.manager.push(PauseScene(self))
+        elif event.key == pygame.K_w and (player.on_ground or player.jumps_left > 0):
+            player.velocity_y = -player.jump_power
+            if not player.on_ground:
+                player.jumps_left -= 1
+            audio.play("jump")
+            self.record_key(event)
+        elif event.key == pygame.K_h and player.target_drone and not player.hacking:
+            self.hacking_game = self.hacking_pool.acquire(player.target_drone)
+            player.hacking = True
+            self.manager.push(HackingScene(self, self.hacking_game))
+            self.record_key(event)
+        elif event.key == REWIND_KEY and self.playback is None:
+            self.rewind()
+        else:
+            return False
+        return True
+    
+    def record_key(self, event):
+        """Клавиша, изменившая симуляцию, - в повтор"""
+        if self.recorder is not None:
+            self.recorder.key(event)
+    
+    def burst(self, kind, rect):
+        """Вспышка частиц kind в центре rect"""
+        if self.particles is not None:
+            self.particles.emit(kind, *rect.center)
+    
+    def end_hack(self, success):
+        """Закрывает диалог взлома; при успехе дрон сбит и роняет рыбу"""
+        hacking_game = self.hacking_game
+        drone = hacking_game.drone
+        if success:
+            # Вспышка - только над дроном, который ещё не улетел за экран
+            rect = drone.rect
+            if drone.has_fish:
+                fish = self.fish_pool.acquire(rect.centerx, rect.centery)
+                self.fishes.append(fish)
+                self.fish_grid.insert(fish, fish.rect)
+            if self.drone_swarm is not None:
+                if self.drone_swarm.remove(drone):
+                    self.burst("hack", rect)
+            elif self.drone_grid.remove(drone):
+                self.drones.remove(drone)
+                self.burst("hack", rect)
+            self.player.target_drone = None
+        if self.drone_swarm is None and drone not in self.drone_grid:
+            # Взломан или улетел, пока шёл взлом
+            self.drone_pool.release(drone)
+        self.hacking_pool.release(hacking_game)
+        self.hacking_game = None
+        self.player.hacking = False
+    
+    def snapshot(self):
+        """Полное состояние симуляции в бинарном виде (форматы SNAPSHOT_*).
+        
+        Кроме значений сохраняется порядок дронов в сетке столкновений: от него
+        зависит порядок её запросов, а значит, кто из дронов станет целью.
+        """
+        player = self.player
+        swarm = self.drone_swarm
+        hacking_game = self.hacking_game
+        flags = (swarm is not None) | (self.streamer is not None) << 1
+        seed = self.streamer.seed if self.streamer is not None else 0
+        upgrades = player.upgrades
+        parts = [
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, flags, self.step_index, self.autosave_steps,
+                                 self.camera.x, self.camera.prev_x, seed),
+            SNAPSHOT_PLAYER.pack(player.x, player.y, *player.rect.topleft, *player.prev_pos,
+                                 player.speed, player.jump_power, player.velocity_y, player.on_ground,
+                                 player.facing_right, player.invincible, player.fish_count,
+                                 upgrades["speed"], upgrades["jump"], upgrades["double_jump"],
+                                 player.health, player.invincible_timer, player.jumps_left),
+        ]
+        parts += [SNAPSHOT_ITEM.pack(item["level"], item["cost"]) for item in self.shop.items]
+        if self.streamer is None:
+            parts.append(SNAPSHOT_COUNT.pack(len(self.platforms)))
+            parts += [SNAPSHOT_RECT.pack(*platform.rect) for platform in self.platforms]
+        
+        if swarm is not None:
+            parts.append(swarm.snapshot())
+            target = player.target_drone.drone_id if player.target_drone is not None else -1
+            hacked = hacking_game.drone.drone_id if hacking_game is not None else -1
+        else:
+            # Взламываемый дрон, уже улетевший из списка, идёт последним
+            drones = list(self.drones)
+            if hacking_game is not None and hacking_game.drone not in self.drone_grid:
+                drones.append(hacking_game.drone)
+            index = {drone: i for i, drone in enumerate(drones)}
+            parts.append(SNAPSHOT_DRONES.pack(len(self.drones), len(drones)))
+            parts += [SNAPSHOT_DRONE.pack(*drone.rect.topleft, *drone.prev_pos, drone.x, drone.speed,
+                                          drone.has_fish, drone.damage) for drone in drones]
+            parts.append(struct.pack(f"<{len(self.drones)}H", *(index[drone] for drone in self.drone_grid.entries)))
+            target = index.get(player.target_drone, -1)
+            hacked = index[hacking_game.drone] if hacking_game is not None else -1
+        parts.append(SNAPSHOT_TARGET.pack(target, hacked))
+        if hacking_game is not None:
+            parts.append(SNAPSHOT_HACK.pack(int(hacking_game.code), hacking_game.input.encode(),
+                                            hacking_game.active))
+        
+        parts.append(SNAPSHOT_COUNT.pack(len(self.fishes)))
+        parts += [SNAPSHOT_FISH.pack(*fish.rect.topleft, fish.lifetime, fish.blink_timer) for fish in self.fishes]
+        version, internal, gauss = rng.getstate()
+        parts.append(SNAPSHOT_RNG.pack(version, *internal, gauss is not None, gauss or 0.0))
+        return b"".join(parts)
+    
+    def restore(self, data):
+        """Возвращает симуляцию к снимку snapshot(); открытый взлом закрывается или открывается заново"""
+        reader = SnapshotReader(data)
+        magic, flags, step_index, autosave_steps, camera_x, camera_prev_x, seed = reader.read(SNAPSHOT_HEADER)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("не снимок состояния")
+        if flags != (self.drone_swarm is not None) | (self.streamer is not None) << 1:
+            raise ValueError("снимок другого режима игры")
+        
+        # Текущие сущности - обратно в пулы; новые достаются оттуда же
+        if self.hacking_game is not None:
+            self.manager.pop()
+        for drone in self.drones:
+            self.drone_grid.remove(drone)
+            self.drone_pool.release(drone)
+        for fish in self.fishes:
+            self.fish_grid.remove(fish)
+            self.fish_pool.release(fish)
+        
+        self.step_index, self.autosave_steps = step_index, autosave_steps
+        self.camera.x, self.camera.prev_x = camera_x, camera_prev_x
+        player = self.player
+        (player.x, player.y, player.rect.x, player.rect.y, prev_x, prev_y, player.speed, player.jump_power,
+         player.velocity_y, player.on_ground, player.facing_right, player.invincible, player.fish_count,
+         player.upgrades["speed"], player.upgrades["jump"], player.upgrades["double_jump"],
+         player.health, player.invincible_timer, player.jumps_left) = reader.read(SNAPSHOT_PLAYER)
+        player.prev_pos = (prev_x, prev_y)
+        for item in self.shop.items:
+            item["level"], item["cost"] = reader.read(SNAPSHOT_ITEM)
+        self.shop.refresh_labels()
+        
+        if self.streamer is None:
+            rects = [reader.read(SNAPSHOT_RECT) for _ in range(reader.read(SNAPSHOT_COUNT)[0])]
+            if rects != [tuple(platform.rect) for platform in self.platforms]:
+                for platform in self.platforms:
+                    self.platform_grid.remove(platform)
+                self.platforms = [Platform(*rect) for rect in rects]
+                for platform in self.platforms:
+                    self.platform_grid.insert(platform, platform.rect)
+        else:
+            if seed != self.streamer.seed:
+                self.streamer.close()
+                self.streamer.unload()
+                self.streamer = ChunkStreamer(seed, self.platform_grid, self.level_layer)
+            self.streamer.update(self.camera.x)
+            self.platforms = self.streamer.platforms
+        
+        if self.drone_swarm is not None:
+            self.drone_swarm.restore(reader)
+            target, hacked = reader.read(SNAPSHOT_TARGET)
+            player.target_drone = SwarmDrone(self.drone_swarm, target) if target >= 0 else None
+            hacked_drone = SwarmDrone(self.drone_swarm, hacked) if hacked >= 0 else None
+        else:
+            listed, total = reader.read(SNAPSHOT_DRONES)
+            drones = []
+            for _ in range(total):
+                x, y, prev_x, prev_y, drone_x, speed, has_fish, damage = reader.read(SNAPSHOT_DRONE)
+                drone = self.drone_pool.acquire(0, 0)
+                drone.rect.topleft = (x, y)
+                drone.prev_pos = (prev_x, prev_y)
+                drone.x, drone.speed, drone.has_fish, drone.damage = drone_x, speed, has_fish, damage
+                drones.append(drone)
+            self.drones = drones[:listed]
+            for i in struct.unpack(f"<{listed}H", reader.take(2 * listed)):
+                self.drone_grid.insert(drones[i], drones[i].rect)
+            target, hacked = reader.read(SNAPSHOT_TARGET)
+            player.target_drone = drones[target] if target >= 0 else None
+            hacked_drone = drones[hacked] if hacked >= 0 else None
+        if hacked_drone is not None:
+            code, typed, active = reader.read(SNAPSHOT_HACK)
+            self.hacking_game = self.hacking_pool.acquire(hacked_drone)
+            self.hacking_game.code = str(code)
+            self.hacking_game.input = typed.rstrip(b"\0").decode()
+            self.hacking_game.active = active
+            player.hacking = True
+            self.manager.push(HackingScene(self, self.hacking_game))
+        
+        self.fishes = []
+        for _ in range(reader.read(SNAPSHOT_COUNT)[0]):
+            x, y, lifetime, blink_timer = reader.read(SNAPSHOT_FISH)
+            fish = self.fish_pool.acquire(0, 0)
+            fish.rect.topleft = (x, y)
+            fish.lifetime, fish.blink_timer = lifetime, blink_timer
+            self.fishes.append(fish)
+            self.fish_grid.insert(fish, fish.rect)
+        
+        # ГСЧ последним: reset() сущностей из пулов его расходует
+        version, *internal, has_gauss, gauss = reader.read(SNAPSHOT_RNG)
+        rng.setstate((version, tuple(internal), gauss if has_gauss else None))
+        
+        while self.history and self.history[-1][0] > self.step_index:
+            self.history.pop()
+        if self.particles is not None:
+            self.particles.clear()
+        self.renderer.invalidate()
+    
+    def rewind(self, seconds=REWIND_STEP_SECONDS):
+        """Откат на seconds назад по буферу снимков; False, если откатываться некуда"""
+        target = self.step_index - seconds * SIM_HZ
+        snapshot = None
+        while self.history:
+            step_index, snapshot = self.history.pop()
+            if step_index <= target:
+                break
+        if snapshot is None:
+            return False
+        self.restore(snapshot)
+        self.history.append((self.step_index, snapshot))
+        if self.recorder is not None:
+            self.recorder.keyframe(self, forced=True)
+        return True
+    
+    def update(self, dt):
+        if self.resumed:
+            self.resumed = False
+            dt = 0
+        step_ms = self.step_ms
+        
+        if self.playback is not None:
+            # Повтор: шаги и качество кадра - из записи
+            steps, level = self.playback.frame_steps()
+        else:
+            # Фиксированные шаги симуляции, накопленные с прошлого кадра
+            self.accumulator += dt
+            steps = 0
+            while self.accumulator >= step_ms and steps < MAX_CATCHUP_STEPS:
+                self.accumulator -= step_ms
+                steps += 1
+            if steps == MAX_CATCHUP_STEPS:
+                # Не догоняем бесконечно после долгих подвисаний
+                self.accumulator = min(self.accumulator, step_ms)
+            level = quality.level
+        
+        keys = self.manager.controls.pressed()
+        if self.recorder is not None:
+            self.recorder.frame(steps, keys[pygame.K_a] | keys[pygame.K_d] << 1, level)
+        drone_cap = quality.levels[level]["drone_cap"]
+        for _ in range(steps):
+            if not self.step(keys, drone_cap):
+                return
+        if self.recorder is not None:
+            self.recorder.end_frame(self)
+        self.alpha = self.accumulator / step_ms
+        
+        if self.streamer is not None:
+            # Подгрузка чанков впереди и выгрузка оставшихся позади
+            self.streamer.update(self.camera.x)
+            self.platforms = self.streamer.platforms
+            self.manager.timings.lap("update.world")
+    
+    def step(self, keys, drone_cap):
+        """Один шаг симуляции; False - игрок погиб и забег окончен"""
+        timings = self.manager.timings
+        player = self.player
+        camera = self.camera
+        player.prev_pos = player.rect.topleft
+        
+        self.autosave_steps -= 1
+        if self.autosave_steps <= 0:
+            self.autosave_steps = AUTOSAVE_SECONDS * SIM_HZ
+            if self.persistent:
+                save_game(player, self.shop)
+        
+        if not player.hacking:
             if keys[pygame.K_a]: 
-                player.rect.x -= player.speed
+                player.move(-player.speed * SIM_DT)
                 player.facing_right = False
             if keys[pygame.K_d]: 
-                player.rect.x += player.speed
+                player.move(player.speed * SIM_DT)
                 player.facing_right = True
+        timings.lap("input")
         
-        player.update(platforms)
-        
-        # Спавн дронов
-        if random.random() < 0.01 and len(drones) < 2 + player.upgrades["speed"]:
-            drones.append(Drone(WIDTH + 100, random.randint(100, HEIGHT-200)))
+        if self.streamer is not None:
+            player.update(self.platform_grid, SIM_DT, left=int(camera.x), right=None)
+            camera.follow(player.rect)
+        else:
+            player.update(self.platform_grid, SIM_DT)
+        timings.lap("update.player")
         
-        # Обновление дронов и проверка урона
-        player.target_drone = None
-        for drone in drones[:]:
-            if drone.update():
-                drones.remove(drone)
-            elif player.rect.colliderect(drone.rect) and not player.hacking:
+        drone_swarm = self.drone_swarm
+        if drone_swarm is not None:
+            # Стресс-режим: рой обновляется одной векторной операцией
+            for _ in range(SWARM_SPAWN_PER_FRAME):
+                if len(drone_swarm) >= SWARM_SIZE * drone_cap:
+                    break
+                if not drone_swarm.spawn(int(camera.x) + rng.randint(WIDTH + 50, WIDTH * 2),
+                                         rng.randint(100, HEIGHT-200)):
+                    break
+            hits = drone_swarm.update(player.rect, SIM_DT, int(camera.x))
+            timings.lap("update.drones")
+            player.target_drone = None
+            if hits.size and not player.hacking:
                 if not player.invincible:
-                    player.take_damage(drone.damage)
-                player.target_drone = drone
+                    # Рамки - отсев, урон только от касания пикселями; взломать можно и по рамке
+                    touching = drone_swarm.first_touching(hits, *player.collision_mask())
+                    if touching is not None:
+                        if player.take_damage(int(drone_swarm.damage[touching])):
+                            self.burst("damage", player.rect)
+                player.target_drone = drone_swarm.view(hits[-1])
+            timings.lap("collision.drones")
+        else:
+            # Спавн дронов
+            limit = max(1, int((2 + player.upgrades["speed"]) * drone_cap))
+            if rng.random() < DRONE_SPAWN_CHANCE * SIM_DT and len(self.drones) < limit:
+                drone = self.drone_pool.acquire(int(camera.x) + WIDTH + 100, rng.randint(100, HEIGHT-200))
+                self.drones.append(drone)
+                self.drone_grid.insert(drone, drone.rect)
+            
+            # Обновление дронов
+            alive = []
+            for drone in self.drones:
+                if drone.update(SIM_DT, int(camera.x)):
+                    self.drone_grid.remove(drone)
+                    # Взламываемый дрон ещё нужен диалогу - в пул его не отдаём
+                    if self.hacking_game is None or drone is not self.hacking_game.drone:
+                        self.drone_pool.release(drone)
+                else:
+                    self.drone_grid.update(drone, drone.rect)
+                    alive.append(drone)
+            self.drones = alive
+            timings.lap("update.drones")
+            
+            # Проверка урона
+            player.target_drone = None
+            if not player.hacking:
+                candidates = self.drone_grid.query_rect(player.rect)
+                if candidates:
+                    # Рамки из сетки - отсев, урон только от касания пикселями
+                    player_mask, player_pos = player.collision_mask()
+                    for drone in candidates:
+                        if not player.invincible and masks_overlap(player_mask, player_pos,
+                                                                   drone.mask, drone.rect.topleft):
+                            if player.take_damage(drone.damage):
+                                self.burst("damage", player.rect)
+                        player.target_drone = drone
+            timings.lap("collision.drones")
         
         # Обновление рыб
-        for fish in fishes[:]:
-            if fish.update():
-                fishes.remove(fish)
-            elif player.rect.colliderect(fish.rect):
-                player.fish_count += 1
-                fishes.remove(fish)
+        alive = []
+        for fish in self.fishes:
+            if fish.update(SIM_DT):
+                self.fish_grid.remove(fish)
+                self.fish_pool.release(fish)
+            else:
+                alive.append(fish)
+        self.fishes = alive
+        timings.lap("update.fish")
         
-        # Проверка смерти
-        if player.health <= 0:
-            save_game(player)
-            return "menu"
+        picked = self.fish_grid.query_rect(player.rect)
+        if picked:
+            player_mask, player_pos = player.collision_mask()
+            picked = [fish for fish in picked
+                      if masks_overlap(player_mask, player_pos, fish.mask, fish.rect.topleft)]
+        if picked:
+            for fish in picked:
+                self.burst("fish", fish.rect)
+                self.fish_grid.remove(fish)
+                self.fish_pool.release(fish)
+            player.fish_count += len(picked)
+            self.fishes = [fish for fish in self.fishes if fish in self.fish_grid]
+        timings.lap("collision.fish")
         
-        # Отрисовка
-        screen.blit(background, (0, 0))
+        if self.particles is not None:
+            self.particles.update(SIM_DT)
+        timings.lap("update.particles")
         
-        for platform in platforms:
-            screen.blit(platform.image, platform.rect)
+        # Проверка смерти
+        if player.health <= 0:
+            self.manager.goto("menu")
+            return False
         
-        for drone in drones:
-            drone.draw(screen)
+        self.step_index += 1
+        if self.step_index % REWIND_EVERY == 0:
+            self.history.append((self.step_index, self.snapshot()))
+        return True
+    
+    def draw(self, screen):
+        timings = self.manager.timings
+        renderer = self.renderer
+        camera = self.camera
+        player = self.player
+        alpha = self.alpha
         
-        for fish in fishes:
-            fish.draw(screen)
+        # Отрисовка: дальше рисуется только то, что видит камера
+        shift = camera.begin_frame(alpha)
+        visible_drones = camera.cull(self.drones)
+        visible_fishes = camera.cull(self.fishes)
+        builds = self.level_layer.builds
+        static_layer = self.level_layer.get(shift if self.streamer is not None else self.platforms)
+        if static_layer is not renderer.background or self.level_layer.builds != builds:
+            renderer.set_background(static_layer)
+        settings = quality.settings
+        scale = settings["render_scale"]
+        self.partial = renderer.enabled and self.drone_swarm is None and scale == 1.0
+        redraw_hud = True
+        if self.partial:
+            renderer.mark(player.dirty_rect.move(-shift, 0))
+            for drone in visible_drones:
+                renderer.mark(drone.dirty_rect.move(-shift, 0))
+            for fish in visible_fishes:
+                renderer.mark(fish.dirty_rect.move(-shift, 0))
+            particles_rect = self.particles.bounds() if self.particles is not None else None
+            if particles_rect is not None:
+                renderer.mark(particles_rect.move(-shift, 0).clip(screen.get_rect()))
+            # HUD можно пропустить, если под ним ничего не восстанавливается
+            redraw_hud = (renderer.full_redraw or not self.hud_rects or self.frame % settings["hud_every"] == 0
+                          or any(rect.collidelist(self.hud_rects) != -1
+                                 for rect in renderer.prev_rects + renderer.rects))
+            if redraw_hud:
+                for rect in self.hud_rects:
+                    renderer.mark_static(rect)
+        else:
+            renderer.invalidate()
+        if scale == 1.0:
+            target = screen
+            renderer.restore(screen)
+        else:
+            target = self.low_frame(static_layer, scale)
+        timings.lap("render.level")
         
-        player.draw(screen)
+        if self.drone_swarm is not None:
+            self.drone_swarm.draw(target, alpha, camera, scale)
+        for drone in visible_drones:
+            drone.draw(target, alpha, shift, scale)
         
-        if hacking_game:
-            hacking_game.draw(screen)
+        for fish in visible_fishes:
+            fish.draw(target, shift, scale)
         
-        draw_fish_counter(screen, player.fish_count)
-        draw_controls(screen)
+        player.draw(target, alpha, shift, scale)
+        if target is not screen:
+            pygame.transform.scale(target, screen.get_size(), screen)
+        timings.lap("render.entities")
         
-        if shop.active:
-            shop.draw(screen)
+        # Частицы - поверх кадра мира в полном разрешении
+        if self.particles is not None:
+            self.particles.draw(screen, camera)
+        timings.lap("render.particles")
         
-        if game_menu.active:
-            game_menu.draw(screen)
+        if redraw_hud:
+            self.hud_rects = [draw_fish_counter(screen, player.fish_count), draw_controls(screen)]
+            if self.partial:
+                for rect in self.hud_rects:
+                    renderer.mark_static(rect)
+        self.frame += 1
+        timings.lap("render.hud")
         
-        pygame.display.flip()
-        clock.tick(FPS)
+        self.counts = None
+        if self.debug_overlay.active or self.telemetry is not None:
+            self.counts = {
+                "drones": len(self.drone_swarm) if self.drone_swarm is not None else len(self.drones),
+                "fishes": len(self.fishes),
+                "platforms": len(self.platforms),
+                "asset_hits": assets.hits,
+                "asset_misses": assets.misses,
+                "text_hits": text_cache.hits,
+                "audio_busy": audio.busy_channels(),
+                "audio_dropped": audio.dropped,
+                "drawn": camera.drawn,
+                "culled": camera.culled,
+                "pool_drones": self.drone_pool.high_water,
+                "pool_fishes": self.fish_pool.high_water,
+                "quality": quality.level,
+                "particles": len(self.particles) if self.particles is not None else 0,
+            }
+            overlay_rect = self.debug_overlay.draw(screen, timings, self.counts)
+            if overlay_rect and self.partial:
+                renderer.mark(overlay_rect)
+        timings.lap("render.overlay")
+    
+    def low_frame(self, static_layer, scale):
+        """Уменьшенный кадр мира с фоном уровня; фон масштабируется только при его пересборке"""
+        size = (round(WIDTH * scale), round(HEIGHT * scale))
+        if self.low_surface is None or self.low_surface.get_size() != size:
+            self.low_surface = pygame.Surface(size).convert()
+            self.low_source = None
+        source = (static_layer, self.level_layer.builds)
+        if self.low_source != source:
+            self.low_background = pygame.transform.scale(static_layer, size)
+            self.low_source = source
+        self.low_surface.blit(self.low_background, (0, 0))
+        return self.low_surface
     
-    return "exit"
+    def present(self):
+        if self.partial:
+            self.renderer.present()
+        else:
+            pygame.display.flip()
+    
+    def end_frame(self, timings):
+        self.debug_overlay.record(timings)
+        quality.record(timings)
+        if self.telemetry is not None and self.counts is not None:
+            self.telemetry.record(timings, self.counts)
+
+def main_game(dirty_rects=DIRTY_RECTS, swarm=False, controls=None, clock=None,
+              max_frames=None, persistent=True, timings=None, telemetry=None, endless=False, replay=None):
+    """Один забег без главного меню (бенчмарк, headless-прогоны).
+    
+    Возвращает "menu" после смерти или выхода в меню, "exit" - после закрытия
+    окна или max_frames кадров. replay - путь для записи повтора.
+    """
+    manager = SceneManager(controls, clock, timings)
+    manager.push(GameScene(dirty_rects, swarm, persistent, telemetry, endless, replay))
+    return manager.run(max_frames)
 
 if __name__ == "__main__":
-    pygame.mixer.music.load(os.path.join('assets', 'sounds', 'background.mp3'))
-    pygame.mixer.music.set_volume(0.5)
-    pygame.mixer.music.play(-1)
-    
-    game_state = "menu"
-    
-    while True:
-        if game_state == "menu":
-            game_state = show_main_menu()
-        elif game_state == "start":
-            game_state = main_game()
-        elif game_state == "exit":
-            pygame.quit()
-            sys.exit()
\ No newline at end of file
+    atexit.register(saves.flush)
+    telemetry = None
+    if TELEMETRY_PATH:
+        telemetry = TelemetryRecorder(TELEMETRY_PATH)
+        atexit.register(telemetry.close)
+    
+    loader = start_loading()
+    
+    manager = SceneManager(routes={
+        "menu": lambda: MainMenuScene(loader),
+        "start": lambda: GameScene(telemetry=telemetry, replay=REPLAY_PATH),
+        "endless": lambda: GameScene(telemetry=telemetry, endless=True, replay=REPLAY_PATH),
+    })
+    manager.goto("menu")
+    manager.run()
+    pygame.quit()
+    sys.exit()
\ No newline at end of file